@@ -1,9 +1,18 @@
 from fastapi import APIRouter,Request
+from fastapi.responses import JSONResponse
 
 
 # from termtrix_common.termtrix_common.redis_client import redis_client
-from sentinel.app.core.redis import redis_client,create_consumer_group
+from sentinel.app.core.redis import redis_client,create_consumer_group,xadd_batch,STREAM
 
+from sentinel.app.config import settings
+from sentinel.app.services.ingest_stream import (
+    IngestBodyTooLarge,
+    IngestDecodeError,
+    is_ndjson,
+    iter_ndjson_chunks,
+    read_json_body,
+)
 
 
 from sentinel.app.logger import logger
@@ -14,23 +23,90 @@ logs = APIRouter()
 
 @logs.post("/internal/logs")
 async def ingest_logs(request: Request):
+    content_encoding = request.headers.get("content-encoding")
+    if is_ndjson(request.headers.get("content-type")):
+        return await ingest_ndjson(request, content_encoding)
+
+    try:
+        events = await read_json_body(request.stream(), content_encoding, settings.INGEST_MAX_BODY_BYTES)
+        if not isinstance(events, list):
+            raise IngestDecodeError("Expected a JSON array of events")
+    except IngestBodyTooLarge as e:
+        logger.error(f"Rejected log batch: {e}")
+        return JSONResponse(status_code=413, content={"status": "error", "detail": str(e)})
+    except ValueError as e:
+        # malformed body (IngestDecodeError, JSONDecodeError, bad UTF-8):
+        # resending the same bytes cannot succeed, so don't ask for a retry
+        logger.error(f"Rejected log batch: {e}")
+        return JSONResponse(status_code=400, content={"status": "error", "detail": str(e)})
+
     try:
-        events = await request.json()
-  
         print("Received logs:", len(events))
 
-        for event in events:
-            # print(event)
-            # event_ = json.dumps(event)
-            await redis_client.xadd("sentinel:logs", {"payload": json.dumps(event)})
-            # fp = make_fingerprint(event)
-            # print(fp)
+        ids = await xadd_batch(
+            STREAM,
+            [json.dumps(event) for event in events],
+            maxlen=settings.INGEST_STREAM_MAXLEN or None,
+            transaction=settings.INGEST_ATOMIC_BATCH,
+        )
+
+        # Per-batch ack: the whole batch is in the stream once we answer 200
+        return {
+            "status": "ok",
+            "accepted": len(ids),
+            "first_id": ids[0] if ids else None,
+            "last_id": ids[-1] if ids else None,
+        }
+    except Exception as e:
+        logger.error(f"Error processing logs: {e}")
+        # non-2xx so the shipper retries the batch instead of dropping it
+        return JSONResponse(status_code=503, content={"status": "error"})
+
+
+async def ingest_ndjson(request: Request, content_encoding: str | None):
+    """
+    Streaming ingest: NDJSON (optionally gzip/zstd) is decoded incrementally
+    and forwarded in chunks of INGEST_CHUNK_SIZE, so memory stays bounded by
+    one chunk no matter how large the batch is.
+    """
+    accepted = 0
+    rejected = 0
+    first_id = last_id = None
+    try:
+        async for payloads, bad in iter_ndjson_chunks(
+            request.stream(),
+            content_encoding,
+            chunk_size=settings.INGEST_CHUNK_SIZE,
+            max_line_bytes=settings.INGEST_MAX_LINE_BYTES,
+        ):
+            rejected += bad
+            if not payloads:
+                continue
+            ids = await xadd_batch(
+                STREAM,
+                payloads,
+                maxlen=settings.INGEST_STREAM_MAXLEN or None,
+                transaction=settings.INGEST_ATOMIC_BATCH,
+            )
+            accepted += len(ids)
+            first_id = first_id or ids[0]
+            last_id = ids[-1]
 
+        print("Received logs:", accepted)
 
-        return {"status": "ok"}
+        return {
+            "status": "ok",
+            "accepted": accepted,
+            "rejected": rejected,
+            "first_id": first_id,
+            "last_id": last_id,
+        }
+    except IngestDecodeError as e:
+        logger.error(f"Rejected log batch: {e}")
+        return JSONResponse(status_code=400, content={"status": "error", "detail": str(e), "accepted": accepted})
     except Exception as e:
         logger.error(f"Error processing logs: {e}")
-        return {"status": "error"}
+        return JSONResponse(status_code=503, content={"status": "error", "accepted": accepted})
 
 
 import hashlib
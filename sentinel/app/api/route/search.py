@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+
+from sentinel.app.config import settings
+from sentinel.app.core.clickhouse import get_clickhouse
+from sentinel.app.core.redis import redis_client
+from sentinel.app.logger import logger
+from sentinel.app.services.log_search import SearchError, SearchQuery, stream_results
+from termtrix_common.termtrix_common.raw_payloads import RawPayloads
+
+
+search = APIRouter(tags=["search"])
+
+NDJSON = "application/x-ndjson"
+
+# decodes raw payloads stored compressed or in the blob store (include_raw)
+raw_payloads = RawPayloads()
+
+
+@search.get("/logs/search")
+async def search_logs(
+    src_ip: str | None = None,
+    dest_ip: str | None = None,
+    source: str | None = None,
+    event_type: str | None = None,
+    status: int | None = Query(None, ge=100, le=599),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: int = 500,
+    cursor: str | None = None,
+    include_raw: bool = False,
+):
+    """
+    Stored events matching the filters, newest first, as NDJSON. A full page
+    ends with a {"next_cursor": ...} line; pass it back as `cursor` for the
+    next page.
+    """
+    try:
+        query = SearchQuery.build(
+            since=since,
+            until=until,
+            limit=limit,
+            default_window=timedelta(hours=settings.SEARCH_DEFAULT_WINDOW_H),
+            max_window=timedelta(hours=settings.SEARCH_MAX_WINDOW_H),
+            max_limit=settings.SEARCH_PAGE_MAX,
+            align_s=settings.SEARCH_CACHE_TTL_S,
+            src_ip=src_ip,
+            dest_ip=dest_ip,
+            source=source,
+            event_type=event_type,
+            status=status,
+            cursor=cursor,
+            include_raw=include_raw,
+        )
+    except SearchError as e:
+        raise HTTPException(400, str(e))
+
+    key = query.cache_key()
+    cached = await cache_get(key)
+    if cached is not None:
+        return Response(content=cached, media_type=NDJSON, headers={"X-Cache": "hit"})
+
+    results = stream_results(get_clickhouse(), query, settings.SEARCH_MAX_EXECUTION_S, raw_payloads)
+    chunks = iterate_in_threadpool(results)
+    try:
+        # fail before the 200 goes out if ClickHouse can't run the query
+        first = await anext(chunks, b"")
+    except Exception as e:
+        logger.error(f"Log search failed: {e}")
+        return JSONResponse(status_code=503, content={"status": "error"})
+
+    return StreamingResponse(
+        stream_and_cache(key, first, chunks, results),
+        media_type=NDJSON,
+        headers={"X-Cache": "miss"},
+    )
+
+
+async def stream_and_cache(key: str, first: bytes, chunks, results):
+    """
+    Pass chunks through to the client, keeping a copy only while the page
+    stays under SEARCH_CACHE_MAX_BYTES. However the response ends (the
+    client may disconnect mid-page), results is closed, which closes the
+    ClickHouse stream instead of leaving the query running.
+    """
+    try:
+        kept = [first] if settings.SEARCH_CACHE_TTL_S else None
+        size = len(first)
+        yield first
+
+        async for chunk in chunks:
+            yield chunk
+            if kept is not None:
+                size += len(chunk)
+                if size > settings.SEARCH_CACHE_MAX_BYTES:
+                    kept = None
+                else:
+                    kept.append(chunk)
+
+        if kept is not None:
+            await cache_set(key, b"".join(kept))
+    finally:
+        # no thread is inside the generator here: a cancelled iterate_in_threadpool
+        # step still waits for its next() to return
+        results.close()
+
+
+async def cache_get(key: str) -> str | None:
+    if not settings.SEARCH_CACHE_TTL_S:
+        return None
+    try:
+        return await redis_client.get(key)
+    except Exception as e:
+        logger.warning(f"Search cache read failed: {e}")
+        return None
+
+
+async def cache_set(key: str, body: bytes):
+    try:
+        await redis_client.set(key, body, ex=settings.SEARCH_CACHE_TTL_S)
+    except Exception as e:
+        logger.warning(f"Search cache write failed: {e}")
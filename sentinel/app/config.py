@@ -17,11 +17,28 @@ class Settings(BaseSettings):
     CH_HOST: str = "CH_HOST"
     CH_PASSWORD: str = "CH_PASSWORD"
     CH_USER: str = "CH_USER"
+    CH_PORT: int = 0  # 0 = default port for the protocol
+    CH_SECURE: bool = False
     
     POSTGRES_DB:str = "POSTGRES_DB"
     POSTGRES_USER:str = "POSTGRES_USER"
     POSTGRES_PASSWORD:str = "POSTGRES_PASSWORD"
 
+    # LOG INGEST
+    INGEST_STREAM_MAXLEN: int = 0  # approximate MAXLEN for sentinel:logs, 0 = no trimming
+    INGEST_ATOMIC_BATCH: bool = False  # MULTI/EXEC each batch instead of a plain pipeline
+    INGEST_CHUNK_SIZE: int = 500  # NDJSON events forwarded per XADD pipeline
+    INGEST_MAX_LINE_BYTES: int = 1048576
+    INGEST_MAX_BODY_BYTES: int = 64 * 1048576  # decoded size of a JSON-array batch, 413 above
+
+    # LOG SEARCH
+    SEARCH_DEFAULT_WINDOW_H: int = 24  # time range when the caller gives no `since`
+    SEARCH_MAX_WINDOW_H: int = 24 * 31
+    SEARCH_PAGE_MAX: int = 5000
+    SEARCH_MAX_EXECUTION_S: int = 30
+    SEARCH_CACHE_TTL_S: int = 15  # 0 disables the result cache
+    SEARCH_CACHE_MAX_BYTES: int = 1048576  # larger pages are streamed but not cached
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8"
@@ -0,0 +1,31 @@
+import threading
+
+from sentinel.app.config import settings
+
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_clickhouse():
+    """
+    Shared ClickHouse client, connected on first use so the API starts
+    without ClickHouse. Session IDs are off so concurrent requests can run
+    queries over the same client (each query gets its own pooled HTTP
+    connection).
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import clickhouse_connect
+
+                _client = clickhouse_connect.get_client(
+                    host=settings.CH_HOST,
+                    port=settings.CH_PORT,
+                    user=settings.CH_USER,
+                    password=settings.CH_PASSWORD,
+                    secure=settings.CH_SECURE,
+                    autogenerate_session_id=False,
+                )
+    return _client
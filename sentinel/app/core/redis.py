@@ -1,4 +1,12 @@
 from redis.asyncio import Redis
+
+from termtrix_common.termtrix_common.topology import (
+    DETECTION_GROUP,
+    NORMALIZED_STREAM,
+    NORMALIZER_GROUP,
+    RAW_STREAM,
+    ensure_topology,
+)
 # from app.logger import logger
 
 
@@ -15,18 +23,28 @@ redis_client = Redis(
 
 # create consumer group
 
-STREAM = "sentinel:logs"
-GROUP = "sentinel-consumers"
+STREAM = RAW_STREAM
+GROUP = NORMALIZER_GROUP
 
 # FOR DETECTION ENGINE
 
-NORMALIZED_EVENT = "normalized:events"
-EVENT_GROUP = "detection-engine"
+NORMALIZED_EVENT = NORMALIZED_STREAM
+EVENT_GROUP = DETECTION_GROUP
 EVENT_CONSUMER = "dectector-1"
 
 async def create_consumer_group():
-    try:
-        await redis_client.xgroup_create(STREAM, GROUP, mkstream=True)
-        await redis_client.xgroup_create(NORMALIZED_EVENT,EVENT_GROUP,mkstream=True)
-    except Exception as e:
-        print("Consumer group already exists")
\ No newline at end of file
+    await ensure_topology(redis_client)
+
+
+async def xadd_batch(stream: str, payloads, maxlen: int | None = None, transaction: bool = False) -> list:
+    """
+    Append a whole batch of payloads to a stream in one round trip.
+
+    transaction=True wraps the batch in MULTI/EXEC so it lands all-or-nothing,
+    maxlen trims the stream approximately (MAXLEN ~) on every append.
+    Returns the stream IDs in payload order.
+    """
+    async with redis_client.pipeline(transaction=transaction) as pipe:
+        for payload in payloads:
+            pipe.xadd(stream, {"payload": payload}, maxlen=maxlen, approximate=True)
+        return await pipe.execute()
@@ -12,6 +12,7 @@ from sentinel.app.api.internal_logs import logs
 # from app.core.redis import redis_client,create_consumer_group
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 from sentinel.app.api.route.triage import triage
+from sentinel.app.api.route.search import search
 
 from sentinel.app.core.redis import redis_client,create_consumer_group
 
@@ -71,6 +72,7 @@ app.include_router(whois)
 app.include_router(router)
 app.include_router(logs)
 app.include_router(triage)
+app.include_router(search)
 
 
 @app.get("/")
@@ -0,0 +1,203 @@
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd bodies are rejected when the codec isn't installed
+    zstandard = None
+
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl", "application/x-jsonlines")
+
+# Upper bound for a single decompress() step so one small compressed chunk
+# cannot expand into an unbounded buffer.
+DECOMPRESS_STEP_BYTES = 1 << 20
+
+# zstd has no output limit per call, but a 128 KiB block takes at least
+# 4 input bytes (RLE block), so feeding it this many bytes at a time keeps
+# every step under DECOMPRESS_STEP_BYTES.
+ZSTD_INPUT_STEP_BYTES = max(4, DECOMPRESS_STEP_BYTES // (131072 // 4))
+
+
+class IngestDecodeError(ValueError):
+    pass
+
+
+class IngestBodyTooLarge(IngestDecodeError):
+    pass
+
+
+# errors a corrupt compressed body can raise, all reported as a 400
+DECODE_ERRORS = (zlib.error, zstandard.ZstdError) if zstandard is not None else (zlib.error,)
+
+
+def is_ndjson(content_type: str | None) -> bool:
+    if not content_type:
+        return False
+    return content_type.split(";", 1)[0].strip().lower() in NDJSON_CONTENT_TYPES
+
+
+class _ZlibStream:
+    """
+    gzip bodies may hold several members back to back (RFC 1952), each
+    decoded with a fresh decompressobj; anything after a deflate stream
+    is an error.
+    """
+
+    def __init__(self, wbits: int):
+        self.wbits = wbits
+        self.members = wbits > zlib.MAX_WBITS
+        self.obj = zlib.decompressobj(wbits)
+        self.fed = False
+
+    def decompress(self, data: bytes):
+        while data:
+            if self.obj.eof:
+                if not self.members:
+                    raise IngestDecodeError("Trailing data after the compressed body")
+                self.obj = zlib.decompressobj(self.wbits)
+            self.fed = True
+            yield self.obj.decompress(data, DECOMPRESS_STEP_BYTES)
+            data = self.obj.unused_data if self.obj.eof else self.obj.unconsumed_tail
+
+    def flush(self) -> bytes:
+        out = self.obj.flush()
+        if self.fed and not self.obj.eof:
+            raise IngestDecodeError("Truncated compressed body")
+        return out
+
+
+class _ZstdStream:
+    """
+    A zstd body may hold several frames; each is decoded with a fresh
+    decompressobj, which can only be used for one frame.
+    """
+
+    def __init__(self):
+        self.decompressor = zstandard.ZstdDecompressor()
+        self.obj = self.decompressor.decompressobj()
+        self.fed = False
+
+    def decompress(self, data: bytes):
+        view = memoryview(data)
+        for start in range(0, len(view), ZSTD_INPUT_STEP_BYTES):
+            piece = view[start:start + ZSTD_INPUT_STEP_BYTES]
+            while piece:
+                if self.obj.eof:
+                    self.obj = self.decompressor.decompressobj()
+                self.fed = True
+                yield self.obj.decompress(piece)
+                piece = self.obj.unused_data if self.obj.eof else b""
+
+    def flush(self) -> bytes:
+        if self.fed and not self.obj.eof:
+            raise IngestDecodeError("Truncated compressed body")
+        return b""
+
+
+def make_decompressor(content_encoding: str | None):
+    """
+    Incremental decompressor for a Content-Encoding header, None for identity.
+    """
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding in ("", "identity"):
+        return None
+    if encoding in ("gzip", "x-gzip"):
+        return _ZlibStream(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return _ZlibStream(zlib.MAX_WBITS)
+    if encoding == "zstd":
+        if zstandard is None:
+            raise IngestDecodeError("zstd Content-Encoding requires the 'zstandard' package")
+        return _ZstdStream()
+    raise IngestDecodeError(f"Unsupported Content-Encoding: {content_encoding}")
+
+
+async def iter_body(chunks, content_encoding: str | None):
+    """
+    Decompressed body bytes, chunk by chunk.
+    """
+    decompressor = make_decompressor(content_encoding)
+    async for chunk in chunks:
+        if decompressor is None:
+            if chunk:
+                yield chunk
+            continue
+        try:
+            for out in decompressor.decompress(chunk):
+                if out:
+                    yield out
+        except DECODE_ERRORS as error:
+            raise IngestDecodeError(f"Corrupt compressed body: {error}") from error
+
+    if decompressor is not None:
+        try:
+            tail = decompressor.flush()
+        except DECODE_ERRORS as error:
+            raise IngestDecodeError(f"Corrupt compressed body: {error}") from error
+        if tail:
+            yield tail
+
+
+async def iter_ndjson_lines(chunks, content_encoding: str | None, max_line_bytes: int):
+    """
+    Split a (possibly compressed) NDJSON body into lines without buffering
+    more than one partial line.
+    """
+    pending = b""
+    async for data in iter_body(chunks, content_encoding):
+        pending += data
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        if len(pending) > max_line_bytes:
+            raise IngestDecodeError(f"NDJSON line exceeds {max_line_bytes} bytes")
+        for line in lines:
+            if line.strip():
+                yield line
+
+    if pending.strip():
+        yield pending
+
+
+async def iter_ndjson_chunks(chunks, content_encoding: str | None, chunk_size: int, max_line_bytes: int):
+    """
+    Validated NDJSON events grouped into lists of at most chunk_size payloads.
+
+    Each payload is the original line text: it is checked with json.loads but
+    never re-encoded. Lines that are not JSON objects are counted and skipped.
+    Yields (payloads, rejected) tuples.
+    """
+    payloads = []
+    rejected = 0
+    async for line in iter_ndjson_lines(chunks, content_encoding, max_line_bytes):
+        try:
+            text = line.decode("utf-8").strip()
+            if not isinstance(json.loads(text), dict):
+                raise ValueError("not an object")
+        except ValueError:
+            rejected += 1
+            continue
+
+        payloads.append(text)
+        if len(payloads) >= chunk_size:
+            yield payloads, rejected
+            payloads = []
+            rejected = 0
+
+    if payloads or rejected:
+        yield payloads, rejected
+
+
+async def read_json_body(chunks, content_encoding: str | None, max_bytes: int):
+    """
+    Whole-body JSON decode for the legacy array format, with decompression.
+    The decoded body is buffered, so it is refused past max_bytes.
+    """
+    parts = []
+    size = 0
+    async for data in iter_body(chunks, content_encoding):
+        size += len(data)
+        if size > max_bytes:
+            raise IngestBodyTooLarge(f"Decoded body exceeds {max_bytes} bytes")
+        parts.append(data)
+    return json.loads(b"".join(parts))
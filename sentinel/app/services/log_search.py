@@ -0,0 +1,265 @@
+import base64
+import hashlib
+import json
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from ipaddress import IPv6Address, ip_address
+from uuid import UUID
+
+
+SEARCH_TABLE = "sentinel_logs"
+CACHE_PREFIX = "sentinel:search:"
+
+# the raw payload is only returned on request: it is the widest column by far
+RESULT_COLUMNS = (
+    "event_id",
+    "ts",
+    "source",
+    "log_origin",
+    "level",
+    "service",
+    "event_type",
+    "message",
+    "src_ip",
+    "dest_ip",
+    "src_port",
+    "dest_port",
+    "protocol",
+    "http_status",
+    "user_agent",
+    "flow_id",
+    "flow_state",
+    "flow_reason",
+    "bytes_toserver",
+    "bytes_toclient",
+    "pkts_toserver",
+    "pkts_toclient",
+    "alerted",
+)
+RAW_COLUMNS = ("raw_json", "raw_zstd", "raw_ref")
+
+
+class SearchError(ValueError):
+    """
+    Invalid search parameters (bad IP, range or cursor)
+    """
+
+
+# ---------------- CURSOR ----------------
+
+def encode_cursor(ts: datetime, event_id: UUID, since: datetime, until: datetime) -> str:
+    """
+    Opaque keyset cursor: the (ts, event_id) of the last row of a page, and
+    the time range of the search, so every page reads the same range
+    """
+    raw = f"{ts.isoformat()}|{event_id}|{since.isoformat()}|{until.isoformat()}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID, datetime, datetime]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, event_id, since, until = raw.split("|")
+        return (
+            _utc(datetime.fromisoformat(ts)),
+            UUID(event_id),
+            _utc(datetime.fromisoformat(since)),
+            _utc(datetime.fromisoformat(until)),
+        )
+    except Exception:
+        raise SearchError("invalid cursor")
+
+
+def _utc(value: datetime) -> datetime:
+    """
+    Naive UTC, the form ClickHouse binds into DateTime64(6, 'UTC') parameters
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _ip(value: str | None, name: str) -> str | None:
+    if not value:
+        return None
+    try:
+        return str(ip_address(value))
+    except ValueError:
+        raise SearchError(f"{name} is not an IP address")
+
+
+# ---------------- QUERY ----------------
+
+@dataclass(frozen=True)
+class SearchQuery:
+    since: datetime
+    until: datetime
+    limit: int
+    src_ip: str | None = None
+    dest_ip: str | None = None
+    source: str | None = None
+    event_type: str | None = None
+    status: int | None = None
+    cursor: str | None = None
+    include_raw: bool = False
+
+    @classmethod
+    def build(
+        cls,
+        *,
+        since: datetime | None,
+        until: datetime | None,
+        limit: int,
+        default_window: timedelta,
+        max_window: timedelta,
+        max_limit: int,
+        align_s: int = 0,
+        **filters,
+    ) -> "SearchQuery":
+        """
+        Validate request parameters. The time range always has bounds (a
+        default window when `since` is missing) so every query can prune
+        partitions. An open-ended `until` is rounded up to align_s seconds,
+        so repeats of the same query share a cache key for that long.
+
+        A cursor carries the range resolved for the first page, which later
+        pages keep: a default window recomputed per page would slide forward
+        and skip the oldest rows.
+        """
+        if filters.get("cursor"):
+            _, _, cursor_since, cursor_until = decode_cursor(filters["cursor"])
+            if (since and _utc(since) != cursor_since) or (until and _utc(until) != cursor_until):
+                raise SearchError("cursor belongs to a different time range")
+            since, until = cursor_since, cursor_until
+
+        if until:
+            until = _utc(until)
+        else:
+            until = _utc(datetime.now(timezone.utc))
+            if align_s:
+                epoch = datetime(1970, 1, 1)
+                buckets = int((until - epoch).total_seconds()) // align_s + 1
+                until = epoch + timedelta(seconds=buckets * align_s)
+        since = _utc(since) if since else until - default_window
+        if since >= until:
+            raise SearchError("since must be before until")
+        if until - since > max_window:
+            raise SearchError(f"time range is limited to {max_window}")
+        if not 1 <= limit <= max_limit:
+            raise SearchError(f"limit must be between 1 and {max_limit}")
+
+        filters["src_ip"] = _ip(filters.get("src_ip"), "src_ip")
+        filters["dest_ip"] = _ip(filters.get("dest_ip"), "dest_ip")
+        return cls(since=since, until=until, limit=limit, **filters)
+
+    def cache_key(self) -> str:
+        params = json.dumps(asdict(self), default=str, sort_keys=True)
+        return CACHE_PREFIX + hashlib.blake2b(params.encode(), digest_size=16).hexdigest()
+
+    def columns(self) -> tuple:
+        return RESULT_COLUMNS + RAW_COLUMNS if self.include_raw else RESULT_COLUMNS
+
+    def sql(self) -> tuple[str, dict]:
+        """
+        Newest first, keyset-paginated on (ts, event_id). Filters on the sort
+        key prefix (source, src_ip) and on ts use the primary index and the
+        daily partitions; dest_ip has a bloom filter skip index.
+        """
+        where = [
+            "ts >= {since:DateTime64(6, 'UTC')}",
+            "ts < {until:DateTime64(6, 'UTC')}",
+        ]
+        parameters = {"since": self.since, "until": self.until, "limit": self.limit}
+
+        if self.source:
+            where.append("source = {source:String}")
+            parameters["source"] = self.source
+        if self.src_ip:
+            where.append("src_ip = toIPv6({src_ip:String})")
+            parameters["src_ip"] = self.src_ip
+        if self.dest_ip:
+            where.append("dest_ip = toIPv6({dest_ip:String})")
+            parameters["dest_ip"] = self.dest_ip
+        if self.event_type:
+            where.append("event_type = {event_type:String}")
+            parameters["event_type"] = self.event_type
+        if self.status is not None:
+            where.append("http_status = {status:UInt16}")
+            parameters["status"] = self.status
+        if self.cursor:
+            cursor_ts, cursor_id, _, _ = decode_cursor(self.cursor)
+            # the plain ts bound lets the index skip everything newer
+            where.append("ts <= {cursor_ts:DateTime64(6, 'UTC')}")
+            where.append("(ts, event_id) < ({cursor_ts:DateTime64(6, 'UTC')}, {cursor_id:UUID})")
+            parameters["cursor_ts"] = cursor_ts
+            parameters["cursor_id"] = cursor_id
+
+        sql = (
+            f"SELECT {', '.join(self.columns())} FROM {SEARCH_TABLE} "
+            f"WHERE {' AND '.join(where)} "
+            "ORDER BY ts DESC, event_id DESC "
+            "LIMIT {limit:UInt32}"
+        )
+        return sql, parameters
+
+
+# ---------------- RESULTS ----------------
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    if isinstance(value, IPv6Address):
+        # IPv4 is stored IPv4-mapped
+        return str(value.ipv4_mapped or value)
+    return str(value)
+
+
+def _with_raw(doc: dict, raw_payloads) -> dict:
+    """
+    Replace the stored raw payload columns with the payload text
+    """
+    parts = {name: doc.pop(name, None) for name in RAW_COLUMNS}
+    try:
+        doc["raw_json"] = raw_payloads.text(**parts)
+    except Exception as e:
+        doc["raw_json"] = None
+        doc["raw_error"] = str(e)
+    return doc
+
+
+def stream_results(client, query: SearchQuery, max_execution_s: int, raw_payloads=None):
+    """
+    Run the query and yield NDJSON chunks, one per block ClickHouse sends,
+    so no more than one block is held in memory. When the page is full a
+    last line {"next_cursor": ...} points at the following page.
+    raw_payloads (a RawPayloads) turns compressed or offloaded raw payloads
+    back into text when the query includes them.
+    """
+    sql, parameters = query.sql()
+    rows = 0
+    last = None
+    with client.query_row_block_stream(
+        sql,
+        parameters=parameters,
+        settings={"max_execution_time": max_execution_s},
+        column_formats={"raw_zstd": "bytes"},
+    ) as stream:
+        names = stream.source.column_names
+        ts_index = names.index("ts")
+        id_index = names.index("event_id")
+        for block in stream:
+            docs = (dict(zip(names, row)) for row in block)
+            if query.include_raw and raw_payloads is not None:
+                docs = (_with_raw(doc, raw_payloads) for doc in docs)
+            lines = [json.dumps(doc, default=_json_value) for doc in docs]
+            if not lines:
+                continue
+            rows += len(lines)
+            last = block[-1]
+            yield ("\n".join(lines) + "\n").encode()
+
+    if rows == query.limit and last is not None:
+        cursor = encode_cursor(last[ts_index], last[id_index], query.since, query.until)
+        yield (json.dumps({"next_cursor": cursor}) + "\n").encode()
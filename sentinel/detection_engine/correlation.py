@@ -0,0 +1,291 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from sentinel.detection_engine.rules import EVENT_FIELDS, RuleIndex, compile_rule, parse_duration, rule_definitions
+
+
+DEFAULT_MAX_PARTIALS = 100000   # (rule, group) partial matches kept across all sequence rules
+DEFAULT_LATENESS_S = 120        # how far behind the newest event a step's event may be processed
+MAX_HELD_PER_PARTIAL = 16       # early step events held per partial, oldest dropped first
+
+# step keys that are not match conditions
+STEP_KEYS = ("source", "within")
+
+
+# ---------------- SEQUENCE RULES ----------------
+
+@dataclass
+class SequenceRule:
+    """
+    Ordered steps, all from the same group_by value. A step's `within` is
+    the longest gap allowed since the previous step; the first step's
+    `within` bounds the whole sequence, from its first event to its last.
+    """
+    id: str
+    name: str
+    severity: str
+    group_by: str
+    steps: tuple            # CompiledRule per step
+    gaps: tuple             # max seconds since the previous step, per step (first: unused)
+    total_s: int
+    emit: dict
+    definition: dict = field(repr=False)
+
+
+def compile_sequence(definition: dict) -> SequenceRule:
+    """
+    Sequence rule dict (with `steps`) -> SequenceRule. Each step is
+    compiled like a single-event rule, so steps get the same predicates,
+    aliases and contains-matching as every other rule.
+    """
+    rule_id = definition["id"]
+    steps = []
+    gaps = []
+    for number, step in enumerate(definition["steps"]):
+        steps.append(compile_rule({
+            "id": f"{rule_id}#{number}",
+            "source": step.get("source"),
+            "match": {key: value for key, value in step.items() if key not in STEP_KEYS},
+        }))
+        gaps.append(parse_duration(step.get("within", "10m")))
+
+    emit = dict(definition.get("emit") or {})
+    group_by = definition.get("group_by", "src_ip")
+    if group_by not in EVENT_FIELDS:
+        raise ValueError(f"rule {rule_id}: {group_by!r} is not a field of normalized events")
+    return SequenceRule(
+        id=rule_id,
+        name=definition.get("name", rule_id),
+        severity=definition.get("severity") or emit.pop("severity", "medium"),
+        group_by=group_by,
+        steps=tuple(steps),
+        gaps=tuple(gaps),
+        total_s=gaps[0],
+        emit=emit,
+        definition=definition,
+    )
+
+
+def load_sequences(definitions: list | None = None) -> list:
+    if definitions is None:
+        definitions = rule_definitions()
+    sequences = []
+    for definition in definitions:
+        if not definition.get("steps"):
+            continue
+        try:
+            sequences.append(compile_sequence(definition))
+        except ValueError as e:
+            print("Skipping invalid sequence rule:", e)
+    return sequences
+
+
+# ---------------- PARTIAL MATCHES ----------------
+
+class Partial:
+    """
+    Progress of one sequence for one group: for each step reached, the
+    most recent event that completed the steps up to it, when the run
+    behind it started, and the events it is made of. Keeping only the
+    latest run per step is enough, as a later run can only leave more
+    time for the next step.
+
+    held keeps step events that arrived before the step they follow
+    (sources are shipped with different lag), as (step, ts, event_id).
+    """
+
+    __slots__ = ("reached", "started", "events", "held", "expires")
+
+    def __init__(self, steps: int):
+        self.reached = [None] * steps
+        self.started = [None] * steps
+        self.events = [None] * steps
+        self.held = []
+        self.expires = 0.0
+
+
+class CorrelationEngine:
+    """
+    Runs sequence rules over the event stream. All steps of all sequence
+    rules go into one RuleIndex, so an event costs one indexed lookup, and
+    only the events matching a step touch state: the partial match of
+    their own (rule, group), an O(1) dict access. Work and memory grow
+    with the number of live partial matches, never with history.
+
+    Events may be processed out of order by up to lateness_s of event
+    time: a step event whose previous step has not been seen yet is held
+    on the partial and replayed when that step arrives, and partials are
+    kept lateness_s past their deadline.
+
+    Partial matches live in one LRU bounded by max_partials. A partial
+    whose next step can no longer arrive in time is dropped as it reaches
+    the cold end; time is event time.
+
+    The state is local to the process: with several detector processes a
+    sequence only completes when all its events reach the same process,
+    and partial matches are lost on restart.
+    """
+
+    def __init__(
+        self,
+        sequences: list,
+        max_partials: int = DEFAULT_MAX_PARTIALS,
+        lateness_s: float = DEFAULT_LATENESS_S,
+    ):
+        self.sequences = {sequence.id: sequence for sequence in sequences}
+        self.max_partials = max_partials
+        self.lateness_s = lateness_s
+        self.steps = {}    # step rule id -> (SequenceRule, step number)
+        step_rules = []
+        for sequence in sequences:
+            for number, step in enumerate(sequence.steps):
+                self.steps[step.id] = (sequence, number)
+                step_rules.append(step)
+        self.index = RuleIndex(step_rules)
+        self.partials = OrderedDict()    # (rule_id, group) -> Partial
+        self.latest_ts = 0.0
+        self.stats = {sequence.id: {"partials": 0, "evicted": 0, "alerts": 0} for sequence in sequences}
+
+    def match(self, event) -> list:
+        """
+        (SequenceRule, step number) of every step the event meets, later
+        steps first so one event never advances a sequence twice
+        """
+        if not self.sequences:
+            return []
+        return sorted(
+            (self.steps[step.id] for step in self.index.matching(event)),
+            key=lambda found: -found[1],
+        )
+
+    def observe(self, event, matched: list | None = None) -> list:
+        """
+        Advance every sequence the event is a step of (matched: the result
+        of match(event), if already known); the completed ones, as
+        (SequenceRule, group, event ids)
+        """
+        if matched is None:
+            matched = self.match(event)
+        if not matched:
+            return []
+        ts = event.ts.timestamp()
+        if ts > self.latest_ts:
+            self.latest_ts = ts
+
+        completed = []
+        for sequence, number in matched:
+            group = getattr(event, sequence.group_by, None)
+            if group is None:
+                continue
+            event_ids = self.advance(sequence, number, group, ts, event.event_id)
+            if event_ids is not None:
+                self.finish(sequence, group)
+                completed.append((sequence, group, event_ids))
+        self.evict()
+        return completed
+
+    def partial(self, sequence: SequenceRule, group) -> Partial:
+        key = (sequence.id, group)
+        partial = self.partials.get(key)
+        if partial is None:
+            partial = Partial(len(sequence.steps))
+            self.partials[key] = partial
+            self.stats[sequence.id]["partials"] += 1
+        else:
+            self.partials.move_to_end(key)
+        return partial
+
+    def advance(self, sequence: SequenceRule, number: int, group, ts: float, event_id) -> tuple | None:
+        """
+        Apply one step event; the sequence's event ids if it completed
+        """
+        if number == 0:
+            return self.reach(sequence, self.partial(sequence, group), 0, ts, ts, (event_id,))
+
+        partial = self.partials.get((sequence.id, group))
+        if partial is not None:
+            before = partial.reached[number - 1]
+            started = partial.started[number - 1]
+            if before is not None and self.follows(sequence, number, before, started, ts):
+                self.partials.move_to_end((sequence.id, group))
+                return self.reach(sequence, partial, number, ts, started, partial.events[number - 1] + (event_id,))
+
+        # the previous step may still be on its way: hold the event for the allowed lateness
+        if ts + self.lateness_s >= self.latest_ts:
+            partial = self.partial(sequence, group)
+            partial.held = [held for held in partial.held if held[1] + self.lateness_s >= self.latest_ts]
+            partial.held.append((number, ts, event_id))
+            del partial.held[:-MAX_HELD_PER_PARTIAL]
+            partial.expires = self.expiry(sequence, partial)
+        return None
+
+    def follows(self, sequence: SequenceRule, number: int, before: float, started: float, ts: float) -> bool:
+        """
+        Can an event at ts be step `number` of a run that reached the
+        previous step at `before` and started at `started`?
+        """
+        return before <= ts and ts - before <= sequence.gaps[number] and ts - started <= sequence.total_s
+
+    def reach(self, sequence: SequenceRule, partial: Partial, number: int, ts: float, started: float, events: tuple):
+        """
+        Record a run that completed the steps up to `number` at ts, then
+        replay the held events of the next step it lets through; the
+        sequence's event ids if it completed
+        """
+        if number == len(sequence.steps) - 1:
+            return events
+        if partial.reached[number] is None or ts >= partial.reached[number]:
+            partial.reached[number] = ts
+            partial.started[number] = started
+            partial.events[number] = events
+
+        following = number + 1
+        for held in sorted((held for held in partial.held if held[0] == following), key=lambda held: held[1]):
+            _, held_ts, held_id = held
+            if self.follows(sequence, following, ts, started, held_ts):
+                partial.held.remove(held)
+                completed = self.reach(sequence, partial, following, held_ts, started, events + (held_id,))
+                if completed is not None:
+                    return completed
+        partial.expires = self.expiry(sequence, partial)
+        return None
+
+    def expiry(self, sequence: SequenceRule, partial: Partial) -> float:
+        """
+        Event time after which no run of the partial can still complete,
+        held events included
+        """
+        latest = 0.0
+        for number in range(len(sequence.steps) - 1):
+            reached = partial.reached[number]
+            if reached is not None:
+                deadline = min(reached + sequence.gaps[number + 1], partial.started[number] + sequence.total_s)
+                latest = max(latest, deadline)
+        for _, held_ts, _ in partial.held:
+            latest = max(latest, held_ts)
+        return latest
+
+    def finish(self, sequence: SequenceRule, group):
+        del self.partials[(sequence.id, group)]
+        stats = self.stats[sequence.id]
+        stats["partials"] -= 1
+        stats["alerts"] += 1
+
+    def evict(self):
+        partials = self.partials
+        while partials:
+            key, partial = next(iter(partials.items()))
+            expired = partial.expires + self.lateness_s < self.latest_ts
+            if len(partials) <= self.max_partials and not expired:
+                return
+            del partials[key]
+            stats = self.stats[key[0]]
+            stats["partials"] -= 1
+            if not expired:
+                stats["evicted"] += 1
+
+    def memory_report(self) -> dict:
+        """
+        rule_id -> live partial matches, evicted ones and alerts
+        """
+        return {rule_id: dict(stats) for rule_id, stats in self.stats.items()}
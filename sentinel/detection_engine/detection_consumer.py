@@ -1,22 +1,71 @@
 
 import asyncio
-import json
+import os
+import time
 
 from sentinel.app.core.redis import redis_client
-from sentinel.detection_engine.termtrix_detection_engine import TermtrixDetectionEngine
+from sentinel.detection_engine.termtrix_detection_engine import TermtrixDetectionEngine, make_windows
+from termtrix_common.termtrix_common.reclaimer import PendingReclaimer
+from termtrix_common.termtrix_common.events import decode_event
+from termtrix_common.termtrix_common.topology import DETECTION_GROUP, NORMALIZED_STREAM, ensure_topology
+
+
+WINDOW_REPORT_INTERVAL_S = int(os.getenv("WINDOW_REPORT_INTERVAL_S", 300))
 
 
 class TermtrixConumerEngine():
-    def __init__(self):
-        self.NORMALIZED_EVENT = "normalized:events"
-        self.GROUP = "detection-engine"
-        self.CONSUMER = "dectector-1"
+    def __init__(self, consumer: str | None = None):
+        self.NORMALIZED_EVENT = NORMALIZED_STREAM
+        self.GROUP = DETECTION_GROUP
+        self.CONSUMER = consumer or os.getenv("CONSUMER_NAME", "dectector-1")
         self.BATCH_SIZE = 100
         self.BLOCK_MS = 3000
-        self.engine = TermtrixDetectionEngine()
+        self.engine = TermtrixDetectionEngine(windows=make_windows(redis=redis_client))
+        self.last_report = time.monotonic()
+
+    async def detect_entries(self, entries):
+        msg_ids = []
+        events = []
+        for msg_id,fields in entries:
+            try:
+                events.append(decode_event(fields["payload"]))
+                msg_ids.append(msg_id)
+            except Exception as e:
+                # left in the PEL, the reclaimer retries or dead-letters it
+                print("Error detecting", msg_id, e)
+
+        try:
+            _, failed = await self.engine.log_distributor(events)
+        except Exception as e:
+            # window state unreachable: nothing was emitted, leave the whole batch to the reclaimer
+            print("Error detecting batch", e)
+            return
+
+        # events that failed evaluation stay in the PEL too
+        ack_ids = [msg_id for index, msg_id in enumerate(msg_ids) if index not in failed]
+        if ack_ids:
+            await redis_client.xack(self.NORMALIZED_EVENT, self.GROUP, *ack_ids)
+
+    def maybe_report(self):
+        """
+        Window and partial-match state per rule, every WINDOW_REPORT_INTERVAL_S
+        """
+        now = time.monotonic()
+        if now - self.last_report < WINDOW_REPORT_INTERVAL_S:
+            return
+        self.last_report = now
+        for rule_id, usage in self.engine.memory_report().items():
+            print(f"state {rule_id}: " + ", ".join(f"{name}={value}" for name, value in usage.items()))
 
     async def consume_and_detect(self):
+        await ensure_topology(redis_client)
+        reclaimer = PendingReclaimer(redis_client, self.NORMALIZED_EVENT, self.GROUP, self.CONSUMER)
+
         while True:
+            self.maybe_report()
+            if reclaimer.due():
+                await self.detect_entries(await reclaimer.reclaim())
+
             events = await redis_client.xreadgroup(
                 groupname=self.GROUP,
                 consumername=self.CONSUMER,
@@ -30,18 +79,18 @@ class TermtrixConumerEngine():
                 continue
 
             for _,entires in events:
-                for msg_id,fields in entires:
-                    print(msg_id,"===>")
-                    event = json.loads(fields["payload"])
-                    # print("event ==>",event)
-                    await self.engine.log_distributor(event=event)
+                await self.detect_entries(entires)
+
+
 
 
 
 
 
+async def main(consumer_name: str | None = None):
+    await TermtrixConumerEngine(consumer_name).consume_and_detect()
 
 
-if __name__ == __name__:
+if __name__ == "__main__":
     print("ENGINE STARTED")
-    asyncio.run(TermtrixConumerEngine().consume_and_detect())
+    asyncio.run(main())
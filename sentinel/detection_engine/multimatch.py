@@ -0,0 +1,128 @@
+from collections import deque
+from urllib.parse import unquote_plus
+
+try:
+    import ahocorasick
+except ImportError:  # optional C automaton (pyahocorasick), pure Python below otherwise
+    ahocorasick = None
+
+
+class AhoCorasick:
+    """
+    Pure-Python Aho-Corasick automaton, flattened into a DFA: every state
+    maps each character straight to its next state (failure links are
+    resolved at build time), so a scan is one dict lookup per character.
+    Transitions back to the root are left out of the tables.
+    """
+
+    def __init__(self, patterns: list):
+        goto = [{}]
+        outputs = [set()]
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    outputs.append(set())
+                state = nxt
+            outputs[state].add(index)
+
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            outputs[state] |= outputs[fail[state]]
+            # inherit the failure state's transitions, then override with our own
+            table = dict(delta[fail[state]])
+            for ch, child in goto[state].items():
+                fail[child] = delta[fail[state]].get(ch, 0) if state else 0
+                table[ch] = child
+                queue.append(child)
+            delta[state] = table
+
+        self.delta = delta
+        self.outputs = [frozenset(found) for found in outputs]
+
+    def search(self, text: str) -> set:
+        """
+        Index of every pattern occurring in text
+        """
+        delta = self.delta
+        outputs = self.outputs
+        state = 0
+        hit_states = []
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                hit_states.append(state)
+        found = set()
+        for state in hit_states:
+            found |= outputs[state]
+        return found
+
+
+class PatternSet:
+    """
+    Literal patterns searched all at once: pyahocorasick when installed,
+    the pure-Python automaton otherwise
+    """
+
+    def __init__(self, patterns: list):
+        self.patterns = list(patterns)
+        if ahocorasick is not None:
+            self.automaton = ahocorasick.Automaton()
+            for index, pattern in enumerate(self.patterns):
+                self.automaton.add_word(pattern, index)
+            self.automaton.make_automaton()
+            self.search = self._search_c
+        else:
+            self.automaton = AhoCorasick(self.patterns)
+            self.search = self.automaton.search
+
+    def _search_c(self, text: str) -> set:
+        return {index for _, index in self.automaton.iter(text)}
+
+
+class FieldMatcher:
+    """
+    Every `*_contains` pattern of every rule for one event field, in one
+    automaton. Text and patterns are case-folded; with url_decode the
+    percent-decoded text is scanned too, so "..%2f" and "../" probes are
+    caught by either spelling. scan() returns the owners (predicate keys)
+    of all patterns found.
+    """
+
+    def __init__(self, field: str, url_decode: bool = False):
+        self.field = field
+        self.url_decode = url_decode
+        self.owners = {}    # case-folded pattern -> set of owner keys
+        self.patterns = None
+        self.pattern_owners = None
+
+    def add(self, owner, patterns):
+        for pattern in patterns:
+            self.owners.setdefault(pattern.casefold(), set()).add(owner)
+
+    def build(self):
+        patterns = list(self.owners)
+        self.patterns = PatternSet(patterns)
+        self.pattern_owners = [frozenset(self.owners[pattern]) for pattern in patterns]
+
+    def scan(self, value: str | None) -> frozenset:
+        if not value:
+            return frozenset()
+        text = value.casefold()
+        found = self.patterns.search(text)
+        if self.url_decode and ("%" in text or "+" in text):
+            decoded = unquote_plus(text).casefold()
+            if decoded != text:
+                found |= self.patterns.search(decoded)
+
+        owners = set()
+        for index in found:
+            owners |= self.pattern_owners[index]
+        return frozenset(owners)
@@ -0,0 +1,175 @@
+import math
+import os
+
+
+WINDOW_KEY_PREFIX = os.getenv("WINDOW_KEY_PREFIX", "sentinel:win")
+# keys idle this long past their window are left to expire (wall clock,
+# garbage collection only: counts and cooldowns are in event time)
+WINDOW_KEY_GRACE_S = int(os.getenv("WINDOW_KEY_GRACE_S", 600))
+
+
+# Applies a batch of window hits and returns 1/0 per hit (threshold
+# reached and not in cooldown), with the same event-time semantics as
+# SlidingWindows. Per hit, ARGV holds bucket, buckets, count, ttl, value
+# ("" for event counts) and KEYS holds:
+#   events    the state hash: head, until, and bucket -> count
+#   distinct  the state hash: head, until, total, then one HyperLogLog per
+#             bucket from bucket - buckets + 1 to bucket + buckets, so
+#             every bucket the live window can cover is declared
+# head is the newest bucket seen, until the bucket before which the group
+# does not alert again. Buckets older than the window are ignored.
+WINDOW_HITS = """
+local fired = {}
+local k = 1
+for i = 1, #ARGV, 5 do
+    local bucket = tonumber(ARGV[i])
+    local buckets = tonumber(ARGV[i + 1])
+    local count = tonumber(ARGV[i + 2])
+    local ttl = tonumber(ARGV[i + 3])
+    local value = ARGV[i + 4]
+    local state = KEYS[k]
+
+    local meta = redis.call("HMGET", state, "head", "until", "total")
+    local head = tonumber(meta[1])
+    local suppressed = tonumber(meta[2])
+    local moved = false
+    if head == nil or bucket > head then
+        head = bucket
+        moved = true
+        redis.call("HSET", state, "head", head)
+    end
+    local oldest = head - buckets
+    local total = nil
+
+    if bucket > oldest then
+        if value == "" then
+            redis.call("HINCRBY", state, bucket, 1)
+            total = 0
+            local fields = redis.call("HGETALL", state)
+            for j = 1, #fields, 2 do
+                local b = tonumber(fields[j])
+                if b then
+                    if b <= oldest then
+                        redis.call("HDEL", state, fields[j])
+                    else
+                        total = total + tonumber(fields[j + 1])
+                    end
+                end
+            end
+        else
+            local first = bucket - buckets + 1
+            local hll = KEYS[k + 1 + bucket - first]
+            local added = redis.call("PFADD", hll, value)
+            redis.call("EXPIRE", hll, ttl)
+            if added == 1 or moved or meta[3] == false then
+                local live = {}
+                for b = oldest + 1, head do
+                    live[#live + 1] = KEYS[k + 1 + b - first]
+                end
+                total = redis.call("PFCOUNT", unpack(live))
+                redis.call("HSET", state, "total", total)
+            else
+                total = tonumber(meta[3])
+            end
+        end
+    end
+
+    local hit = 0
+    if total and total >= count and (suppressed == nil or bucket >= suppressed) then
+        redis.call("HSET", state, "until", bucket + buckets)
+        hit = 1
+    end
+    redis.call("EXPIRE", state, ttl)
+    fired[#fired + 1] = hit
+
+    if value == "" then
+        k = k + 1
+    else
+        k = k + 1 + 2 * buckets
+    end
+end
+return fired
+"""
+
+
+class RedisWindows:
+    """
+    Window state shared by every detector process, kept in Redis with the
+    same bucketed layout and event-time semantics as SlidingWindows. A
+    batch of hits is applied by a single Lua script call, which Redis runs
+    atomically: a batch that fails is not partly counted when it is
+    retried, and it costs one round trip.
+
+    Every key a hit touches is declared in KEYS, but a batch spans many
+    groups, so Redis must be a single node (or a replicated primary), not
+    Redis Cluster. Distinct counts are HyperLogLog estimates (~0.8% error).
+    """
+
+    def __init__(self, redis, prefix: str = WINDOW_KEY_PREFIX, buckets: int = 12):
+        self.redis = redis
+        self.prefix = prefix
+        self.buckets = buckets
+        self.script = redis.register_script(WINDOW_HITS)
+        self.rules = {}
+
+    def rule_window(self, rule) -> dict:
+        window = self.rules.get(rule.id)
+        if window is None:
+            threshold = rule.threshold
+            buckets = max(1, min(self.buckets, threshold.window_s))
+            bucket_s = threshold.window_s / buckets
+            window = {
+                "buckets": buckets,
+                "bucket_s": bucket_s,
+                "count": threshold.count,
+                "ttl": math.ceil(threshold.window_s + bucket_s) + WINDOW_KEY_GRACE_S,
+                "hits": 0,
+                "alerts": 0,
+            }
+            self.rules[rule.id] = window
+        return window
+
+    def hit_keys(self, rule, group, ts: float, value) -> tuple:
+        """
+        (KEYS, ARGV) of one hit
+        """
+        window = self.rule_window(rule)
+        window["hits"] += 1
+        buckets = window["buckets"]
+        bucket = int(ts // window["bucket_s"])
+        key = f"{self.prefix}:{rule.id}:{group}"
+        keys = [key]
+        if value is not None:
+            keys += [f"{key}:d:{b}" for b in range(bucket - buckets + 1, bucket + buckets + 1)]
+        args = [bucket, buckets, window["count"], window["ttl"], "" if value is None else str(value)]
+        return keys, args
+
+    async def hit_many(self, hits: list) -> list:
+        """
+        [(rule, group, ts, value)] -> [reached threshold?], in order
+        """
+        if not hits:
+            return []
+        keys = []
+        args = []
+        for hit in hits:
+            hit_keys, hit_args = self.hit_keys(*hit)
+            keys += hit_keys
+            args += hit_args
+        result = await self.script(keys=keys, args=args)
+
+        fired = [bool(flag) for flag in result]
+        for (rule, *_), hit in zip(hits, fired):
+            if hit:
+                self.rules[rule.id]["alerts"] += 1
+        return fired
+
+    def memory_report(self) -> dict:
+        """
+        rule_id -> hits sent and alerts raised by this process; the state
+        itself lives in Redis (see MEMORY USAGE on the rule's keys)
+        """
+        return {
+            rule_id: {"hits": window["hits"], "alerts": window["alerts"]}
+            for rule_id, window in self.rules.items()
+        }
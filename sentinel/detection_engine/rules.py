@@ -0,0 +1,355 @@
+import json
+import re
+from dataclasses import dataclass, field, fields
+from operator import attrgetter
+from pathlib import Path
+
+from sentinel.detection_engine.multimatch import FieldMatcher
+from sentinel.detection_engine.yaml_to_dict import load_rule
+from termtrix_common.termtrix_common.events import NormalizedEvent
+
+
+RULES_DIR = Path(__file__).resolve().parent
+NGINX_RULES_FILE = RULES_DIR / "NGINX_RULES.json"
+YAML_RULES_DIR = RULES_DIR.parent / "rules"
+
+# alternative spellings used across the JSON and YAML rule files
+MATCH_ALIASES = {"status_code": "http_status"}
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# what rules can match, group or count on
+EVENT_FIELDS = frozenset(f.name for f in fields(NormalizedEvent))
+
+
+def parse_duration(value) -> int:
+    """
+    300, "300", "5m", "1h" -> seconds
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    found = re.fullmatch(r"\s*(\d+)\s*([smhd]?)\s*", str(value))
+    if not found:
+        raise ValueError(f"invalid duration {value!r}")
+    return int(found.group(1)) * DURATION_UNITS[found.group(2) or "s"]
+
+
+def _as_list(value) -> list:
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def request_path(message: str | None) -> str:
+    """
+    "GET /login?next=/ HTTP/1.1" -> "/login"
+    """
+    if not message:
+        return ""
+    parts = message.split(" ", 2)
+    target = parts[1] if len(parts) > 1 else parts[0]
+    return target.split("?", 1)[0]
+
+
+# ---------------- PREDICATES ----------------
+#
+# Each predicate tests one field of a NormalizedEvent; scan is the event's
+# EventScan (shared substring search results). cost is a rough relative
+# price; a rule runs its cheapest predicates first so most events are
+# rejected before any substring scan.
+
+class Equals:
+    cost = 1
+
+    def __init__(self, name: str, value):
+        self.name = name
+        self.get = attrgetter(name)
+        self.value = value
+
+    def __call__(self, event, scan) -> bool:
+        return self.get(event) == self.value
+
+
+class OneOf:
+    cost = 1
+
+    def __init__(self, name: str, values):
+        self.name = name
+        self.get = attrgetter(name)
+        self.values = frozenset(values)
+
+    def __call__(self, event, scan) -> bool:
+        return self.get(event) in self.values
+
+
+class PathPrefix:
+    cost = 2
+
+    def __init__(self, prefixes):
+        self.name = "http_path"
+        self.prefixes = tuple(prefixes)
+
+    def __call__(self, event, scan) -> bool:
+        return request_path(event.message).startswith(self.prefixes)
+
+
+class Contains:
+    """
+    Case-insensitive "any of these substrings" on one field. The patterns
+    live in the field's shared automaton (see RuleIndex); the predicate
+    only checks whether the event's scan of that field found one of them.
+    """
+
+    cost = 5   # the first contains-check of a field pays for its scan, later ones are free
+
+    def __init__(self, name: str, needles, key: str):
+        self.name = name
+        self.needles = tuple(needles)
+        self.key = key
+
+    def __call__(self, event, scan) -> bool:
+        return self.key in scan(self.name)
+
+
+# `*_contains` match key -> event field it scans
+CONTAINS_FIELDS = {
+    "request_contains": "message",
+    "message_contains": "message",
+    "user_agent_contains": "user_agent",
+    "signature": "message",    # suricata alert signature (carried in message)
+}
+
+# fields whose percent-encoded form is scanned decoded as well
+URL_DECODED_FIELDS = frozenset({"message"})
+
+
+def event_field(rule_id: str, name: str) -> str:
+    if name not in EVENT_FIELDS:
+        raise ValueError(f"rule {rule_id}: {name!r} is not a field of normalized events")
+    return name
+
+
+def compile_condition(rule_id: str, key: str, value):
+    key = MATCH_ALIASES.get(key, key)
+    if key == "http_path":
+        return PathPrefix(_as_list(value))
+    if key in CONTAINS_FIELDS:
+        return Contains(CONTAINS_FIELDS[key], _as_list(value), key=f"{rule_id}/{key}")
+    event_field(rule_id, key)
+    if isinstance(value, (list, tuple, set)):
+        return OneOf(key, value)
+    return Equals(key, value)
+
+
+# ---------------- RULES ----------------
+
+@dataclass
+class Threshold:
+    count: int
+    window_s: int
+    group_by: str
+    distinct: str | None = None    # count distinct values of this field instead of events
+
+
+@dataclass
+class CompiledRule:
+    id: str
+    name: str
+    source: str | None
+    event_types: frozenset | None    # None: any event_type
+    severity: str
+    predicates: tuple
+    threshold: Threshold | None
+    emit: dict
+    definition: dict = field(repr=False)
+
+    def matches(self, event, scan) -> bool:
+        for predicate in self.predicates:
+            if not predicate(event, scan):
+                return False
+        return True
+
+
+def compile_rule(definition: dict) -> CompiledRule:
+    """
+    Rule dict (JSON or YAML) -> CompiledRule. source and event_type become
+    index keys; every other match key becomes a predicate. Keys that name
+    no event field raise ValueError.
+    """
+    match = dict(definition.get("match") or {})
+    event_types = match.pop("event_type", None)
+    predicates = sorted(
+        (compile_condition(definition["id"], key, value) for key, value in match.items()),
+        key=lambda predicate: predicate.cost,
+    )
+
+    threshold = None
+    condition = definition.get("condition")
+    if condition and "count" in condition:
+        distinct = condition.get("distinct")
+        threshold = Threshold(
+            count=int(condition["count"]),
+            window_s=parse_duration(condition.get("window", 60)),
+            group_by=event_field(definition["id"], condition.get("group_by", "src_ip")),
+            distinct=event_field(definition["id"], distinct) if distinct is not None else None,
+        )
+
+    return CompiledRule(
+        id=definition["id"],
+        name=definition.get("name", definition["id"]),
+        source=definition.get("source"),
+        event_types=frozenset(_as_list(event_types)) if event_types else None,
+        severity=definition.get("severity", "medium"),
+        predicates=tuple(predicates),
+        threshold=threshold,
+        emit=definition.get("emit") or {},
+        definition=definition,
+    )
+
+
+class EventScan:
+    """
+    Per-event memo of the multi-pattern scans: each field is searched at
+    most once, however many rules check it
+    """
+
+    __slots__ = ("event", "matchers", "results")
+
+    def __init__(self, event, matchers: dict):
+        self.event = event
+        self.matchers = matchers
+        self.results = {}
+
+    def __call__(self, field: str) -> frozenset:
+        found = self.results.get(field)
+        if found is None:
+            found = self.matchers[field].scan(getattr(self.event, field))
+            self.results[field] = found
+        return found
+
+
+class RuleIndex:
+    """
+    Rules bucketed by (source, event_type). An event is only tested against
+    the rules of its own bucket plus the rules that don't pin an event_type
+    or a source, so adding rules for other sources or event types costs it
+    nothing.
+
+    The `*_contains` patterns of all rules are compiled into one
+    Aho-Corasick automaton per field, so one pass over a field finds every
+    rule pattern in it.
+    """
+
+    def __init__(self, rules: list):
+        self.rules = rules
+        self.buckets = {}
+        self.matchers = {}
+        for rule in rules:
+            for event_type in rule.event_types or (None,):
+                self.buckets.setdefault((rule.source, event_type), []).append(rule)
+            for predicate in rule.predicates:
+                if isinstance(predicate, Contains):
+                    matcher = self.matchers.get(predicate.name)
+                    if matcher is None:
+                        matcher = FieldMatcher(predicate.name, url_decode=predicate.name in URL_DECODED_FIELDS)
+                        self.matchers[predicate.name] = matcher
+                    matcher.add(predicate.key, predicate.needles)
+        for matcher in self.matchers.values():
+            matcher.build()
+        self.lookup = {}
+
+    def scan(self, event) -> EventScan:
+        return EventScan(event, self.matchers)
+
+    def contains_hits(self, event) -> dict:
+        """
+        field -> keys ("<rule_id>/<match key>") of every contains-condition
+        the event satisfies, one automaton pass per field
+        """
+        scan = self.scan(event)
+        return {field: scan(field) for field in self.matchers}
+
+    def candidates(self, source: str | None, event_type: str | None) -> tuple:
+        """
+        (plain rules, {contains key: rule}) that may match an event of this
+        source and event_type. A rule with a contains-condition is only
+        reached through a scan hit on its key, so signature rules that don't
+        occur in the event cost nothing.
+        """
+        key = (source, event_type)
+        found = self.lookup.get(key)
+        if found is None:
+            plain = []
+            gated = {}
+            for bucket in dict.fromkeys([key, (source, None), (None, event_type), (None, None)]):
+                for rule in self.buckets.get(bucket, ()):
+                    gate = next((p for p in rule.predicates if isinstance(p, Contains)), None)
+                    if gate is None:
+                        plain.append(rule)
+                    else:
+                        gated.setdefault(gate.name, {})[gate.key] = rule
+            found = (tuple(plain), gated)
+            self.lookup[key] = found
+        return found
+
+    def matching(self, event):
+        """
+        Every rule whose conditions the event meets (thresholds aside)
+        """
+        scan = self.scan(event)
+        plain, gated = self.candidates(event.source, event.event_type)
+        for rule in plain:
+            if rule.matches(event, scan):
+                yield rule
+        for field, rules in gated.items():
+            for key in scan(field):
+                rule = rules.get(key)
+                if rule is not None and rule.matches(event, scan):
+                    yield rule
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+
+# ---------------- LOADING ----------------
+
+def rule_definitions(json_file: Path = NGINX_RULES_FILE, yaml_dir: Path = YAML_RULES_DIR) -> list:
+    """
+    Every rule dict from the JSON rule file and the YAML rule tree. Empty
+    files are skipped; when two files define the same id the first one wins.
+    """
+    definitions = []
+    if json_file.exists():
+        with open(json_file, "r") as f:
+            definitions += json.load(f)
+    if yaml_dir.is_dir():
+        for path in sorted(yaml_dir.rglob("*.yaml")):
+            rule = load_rule(str(path))
+            if rule:
+                definitions.append(rule)
+
+    seen = set()
+    unique = []
+    for definition in definitions:
+        if definition["id"] in seen:
+            print(f"Duplicate rule id {definition['id']}, keeping the first definition")
+            continue
+        seen.add(definition["id"])
+        unique.append(definition)
+    return unique
+
+
+def load_rules(definitions: list | None = None) -> RuleIndex:
+    """
+    Compile the single-event rules. Sequence rules (with `steps`) are left
+    to the correlation stage; invalid rules are reported and left out.
+    """
+    if definitions is None:
+        definitions = rule_definitions()
+    rules = []
+    for definition in definitions:
+        if "steps" in definition:
+            continue
+        try:
+            rules.append(compile_rule(definition))
+        except ValueError as e:
+            print("Skipping invalid rule:", e)
+    return RuleIndex(rules)
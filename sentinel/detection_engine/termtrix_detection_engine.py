@@ -1,96 +1,151 @@
-import json
+import os
+
+from sentinel.detection_engine.correlation import CorrelationEngine, load_sequences
+from sentinel.detection_engine.redis_windows import RedisWindows
+from sentinel.detection_engine.rules import RuleIndex, load_rules
+from sentinel.detection_engine.windows import SlidingWindows
+
+
+# memory: counters local to this process
+# redis:  counters shared by every detector process
+# Sequence rules are not covered by either: their partial matches stay in
+# the process, so with several detectors a sequence whose events land on
+# different processes never completes, and partials are lost on restart.
+# Run sequence rules on a single detector (or one consumer per group_by
+# shard) until that state is shared as well.
+WINDOW_BACKEND = os.getenv("WINDOW_BACKEND", "memory")
+WINDOW_MAX_KEYS = int(os.getenv("WINDOW_MAX_KEYS", 500000))
+WINDOW_BUCKETS = int(os.getenv("WINDOW_BUCKETS", 12))
+CORRELATION_MAX_PARTIALS = int(os.getenv("CORRELATION_MAX_PARTIALS", 100000))
+# how far (event time) a sequence step may trail the newest event and still correlate
+CORRELATION_LATENESS_S = int(os.getenv("CORRELATION_LATENESS_S", 120))
+
+
+def make_windows(backend: str = WINDOW_BACKEND, redis=None):
+    if backend == "memory":
+        return SlidingWindows(max_keys=WINDOW_MAX_KEYS, buckets=WINDOW_BUCKETS)
+    if backend == "redis":
+        if redis is None:
+            raise ValueError("the redis window backend needs a redis client")
+        return RedisWindows(redis, buckets=WINDOW_BUCKETS)
+    raise ValueError(f"unknown window backend {backend!r}, expected memory or redis")
+
 
 class TermtrixDetectionEngine:
-    NGINX_RULES = None
-    def __init__(self):
-        if TermtrixDetectionEngine.NGINX_RULES is None:
-            TermtrixDetectionEngine.NGINX_RULES = self.load_rules()
-
-
-
-    def load_rules(self):
-        with open("./sentinel/detection_engine/NGINX_RULES.json", "r") as f:
-            print("loading rules")
-            RULES = json.load(f)
-            # print(RULES)
-            NGINX_RULES = [r for r in RULES if r["source"] == "nginx"]
-            # print(NGINX_RULES)
-            return NGINX_RULES
-    
-
-
-    async def log_distributor(self,event:dict):
-         try:
-            event_type = event.get('event_type')
-            if event_type == "http":
-                await self.nginx_vialotion_detector(event)
-            elif event_type == "application":
-                print("APPLICATION")
-            elif event_type == "flow":
-                print("FLOW")
-         except Exception as error:
-            pass
-        
-    
-    # EVALUATE NGINX RULES
-
-    async def evealuate_rules(self,event:dict):
-        try:
-            alert = []
-            for rule in TermtrixDetectionEngine.NGINX_RULES:
-                # print(rule)
-                # if not self.match_basic(rule,event):
-                #     continue
-
-                print(self.match_basic(rule,event), "ALERT!!!! -->>>> ",rule)
-            return False
-        except Exception as error:
-            print(error)
-            return []
-
-
-
-    # MATCH BASIC THINGS
-
-    def match_basic(self,rule:dict,event:dict) -> bool:
-        match = rule.get("match", {})
-        # print(match,"===>MATCH",event)
-        if "event_type" in match:
-            if event.get("event_type") != match["event_type"]:
-                print("EVENT_TYPE")
-                return False
-
-        # if "http_path" in match:
-        #     if match["http_path"] not in (event.get("message") or ""):
-        #         return False
-
-        if "http_status" in match:
-            if event.get("http_status") not in match["http_status"]:
-                print("STATUS")
-                return False
-        print("TRUEEEEEEEEEE")
-        return True
-
-    async def nginx_vialotion_detector(self,event:dict):
-        try:
-            if event.get('event_type') != "http":
+    """
+    Evaluates normalized events against the compiled rule index. Rules are
+    compiled once per process; an event only touches the rules indexed
+    under its (source, event_type). Sequence rules run in the correlation
+    engine, whose partial matches are local to this process.
+    """
+
+    RULES: RuleIndex | None = None
+    SEQUENCES: list | None = None
+
+    def __init__(self, windows=None):
+        if TermtrixDetectionEngine.RULES is None:
+            TermtrixDetectionEngine.RULES = self.load_rules()
+            TermtrixDetectionEngine.SEQUENCES = load_sequences()
+            print(f"{len(TermtrixDetectionEngine.SEQUENCES)} sequence rules compiled")
+        self.rules = TermtrixDetectionEngine.RULES
+        self.windows = windows or make_windows()
+        self.correlation = CorrelationEngine(
+            TermtrixDetectionEngine.SEQUENCES,
+            max_partials=CORRELATION_MAX_PARTIALS,
+            lateness_s=CORRELATION_LATENESS_S,
+        )
+
+    def load_rules(self) -> RuleIndex:
+        print("loading rules")
+        rules = load_rules()
+        print(f"{len(rules)} rules compiled")
+        return rules
+
+    async def log_distributor(self, events: list) -> tuple:
+        """
+        (alerts, indexes of the events that could not be evaluated) for a
+        batch of events.
+
+        Every event is matched first and the batch's counting-rule hits are
+        applied to the window state in one call. Only then are alerts
+        emitted and sequences advanced, so when the window state fails
+        nothing has happened yet and the whole batch can be redelivered.
+        """
+        failed = set()
+        matched = []
+        hits = []
+        for index, event in enumerate(events):
+            try:
+                rules = list(self.rules.matching(event))
+                steps = self.correlation.match(event)
+                for rule in rules:
+                    if rule.threshold is not None:
+                        hit = self.window_hit(rule, event)
+                        if hit is not None:
+                            hits.append((hit, (rule, event)))
+            except Exception as error:
+                print("Error evaluating rules", error)
+                failed.add(index)
+                continue
+            matched.append((event, rules, steps))
+
+        fired = await self.windows.hit_many([hit for hit, _ in hits])
+
+        alerts = []
+        for event, rules, steps in matched:
+            for sequence, group, event_ids in self.correlation.observe(event, steps):
+                alerts.append(self.sequence_alert(sequence, group, event, event_ids))
+            for rule in rules:
+                if rule.threshold is None:
+                    alerts.append(self.alert(rule, event))
+        for (_, (rule, event)), reached in zip(hits, fired):
+            if reached:
+                alerts.append(self.alert(rule, event))
+        return alerts, failed
+
+    def window_hit(self, rule, event) -> tuple | None:
+        """
+        (rule, group, ts, value) to count for a counting rule (condition:
+        count/window/group_by[/distinct]). Events without a group value, or
+        without the distinct field, are not counted.
+        """
+        threshold = rule.threshold
+        group = getattr(event, threshold.group_by, None)
+        if group is None:
+            return None
+        value = None
+        if threshold.distinct is not None:
+            value = getattr(event, threshold.distinct, None)
+            if value is None:
                 return None
-
-            # http_status = TermtrixDetectionEngine.RULE.get('NGINX',{}).get('match')
-            # print(http_status,"http_status")
-            # if event.get("http_status") not in http_status.get("http_status"):
-            #     return None
-
-            await self.evealuate_rules(event)
-
-            src_ip = event.get("src_ip")
-
-            print(src_ip)
-            
-        except Exception as e:
-            print("Error in detect_based_on_rule", e)
-
-
-# if __name__ == "__main__":
-#     t = TermtrixDetectionEngine()
-  
+        return (rule, group, event.ts.timestamp(), value)
+
+    def memory_report(self) -> dict:
+        return {**self.windows.memory_report(), **self.correlation.memory_report()}
+
+    def alert(self, rule, event) -> dict:
+        alert = {
+            "rule_id": rule.id,
+            "rule_name": rule.name,
+            "severity": rule.severity,
+            "source": event.source,
+            "event_id": str(event.event_id),
+            "src_ip": event.src_ip,
+            **rule.emit,
+        }
+        print("ALERT", alert)
+        return alert
+
+    def sequence_alert(self, sequence, group, event, event_ids: tuple) -> dict:
+        alert = {
+            "rule_id": sequence.id,
+            "rule_name": sequence.name,
+            "severity": sequence.severity,
+            "source": "correlation",
+            "event_id": str(event.event_id),
+            sequence.group_by: group,
+            "event_ids": [str(event_id) for event_id in event_ids],
+            **sequence.emit,
+        }
+        print("ALERT", alert)
+        return alert
@@ -0,0 +1,216 @@
+import sys
+from collections import OrderedDict
+
+
+DEFAULT_BUCKETS = 12          # ring slots per window: the window slides in window/12 steps
+DEFAULT_MAX_KEYS = 500000     # (rule, group) counters kept across all rules
+
+
+class WindowCounter:
+    """
+    Event count over the last `window` seconds, kept as a ring of buckets
+    of width window / len(counts). Adding expires the buckets that slid out
+    of the window first, so both are O(1) amortized and memory is fixed.
+    """
+
+    __slots__ = ("counts", "total", "head", "suppressed_until")
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * buckets
+        self.total = 0
+        self.head = None              # absolute index of the newest bucket
+        self.suppressed_until = 0     # absolute bucket index before which the key does not re-alert
+
+    def advance(self, bucket: int):
+        size = len(self.counts)
+        if self.head is None or bucket - self.head >= size:
+            self.counts = [0] * size
+            self.total = 0
+        else:
+            for step in range(self.head + 1, bucket + 1):
+                slot = step % size
+                self.total -= self.counts[slot]
+                self.counts[slot] = 0
+        self.head = bucket
+
+    def add(self, bucket: int) -> int | None:
+        """
+        Count one event in an absolute bucket, return the window total.
+        Events older than the window are ignored (None); late events still
+        inside it land in their own bucket.
+        """
+        if self.head is None or bucket > self.head:
+            self.advance(bucket)
+        elif bucket <= self.head - len(self.counts):
+            return None
+        self.counts[bucket % len(self.counts)] += 1
+        self.total += 1
+        return self.total
+
+
+class DistinctCounter:
+    """
+    Distinct values over the last `window` seconds: the same ring, holding
+    the set of values seen in each bucket. A value adds to the total only
+    when no live bucket has it yet; expiring buckets recounts the union.
+    """
+
+    __slots__ = ("values", "total", "head", "suppressed_until")
+
+    def __init__(self, buckets: int):
+        self.values = [None] * buckets
+        self.total = 0
+        self.head = None
+        self.suppressed_until = 0
+
+    def advance(self, bucket: int):
+        size = len(self.values)
+        if self.head is None or bucket - self.head >= size:
+            self.values = [None] * size
+        else:
+            for step in range(self.head + 1, bucket + 1):
+                self.values[step % size] = None
+        self.head = bucket
+        self.total = len(set().union(*(seen for seen in self.values if seen)))
+
+    def add(self, bucket: int, value) -> int | None:
+        if self.head is None or bucket > self.head:
+            self.advance(bucket)
+        elif bucket <= self.head - len(self.values):
+            return None
+        slot = bucket % len(self.values)
+        seen = self.values[slot]
+        if seen is None:
+            seen = self.values[slot] = set()
+        elif value in seen:
+            return self.total
+        if not any(value in other for other in self.values if other):
+            self.total += 1
+        seen.add(value)
+        return self.total
+
+    def size(self) -> int:
+        return sum(len(seen) for seen in self.values if seen)
+
+
+class RuleWindow:
+    """
+    Per-rule window geometry and key statistics
+    """
+
+    __slots__ = ("rule_id", "count", "window_s", "bucket_s", "buckets", "counter", "keys", "evicted", "alerts")
+
+    def __init__(self, rule_id: str, count: int, window_s: int, buckets: int, distinct: bool = False):
+        self.rule_id = rule_id
+        self.count = count
+        self.window_s = window_s
+        self.buckets = max(1, min(buckets, window_s))
+        self.bucket_s = window_s / self.buckets
+        self.counter = DistinctCounter if distinct else WindowCounter
+        self.keys = 0
+        self.evicted = 0
+        self.alerts = 0
+
+
+class SlidingWindows:
+    """
+    Windowed counts for count/window/group_by rule conditions, keyed by
+    (rule_id, group value). All counters share one LRU: hitting max_keys
+    evicts the least recently updated key, and keys whose whole window has
+    passed are dropped as they reach the cold end.
+
+    A key alerts once when its count reaches the threshold, then stays
+    quiet for one window. Rules with `distinct` count distinct values of
+    that field instead of events.
+    """
+
+    def __init__(self, max_keys: int = DEFAULT_MAX_KEYS, buckets: int = DEFAULT_BUCKETS):
+        self.max_keys = max_keys
+        self.buckets = buckets
+        self.rules = {}
+        self.counters = OrderedDict()    # (rule_id, group) -> (WindowCounter, RuleWindow)
+        self.latest_ts = 0.0
+
+    def rule_window(self, rule) -> RuleWindow:
+        window = self.rules.get(rule.id)
+        if window is None:
+            threshold = rule.threshold
+            window = RuleWindow(
+                rule.id, threshold.count, threshold.window_s, self.buckets, distinct=threshold.distinct is not None
+            )
+            self.rules[rule.id] = window
+        return window
+
+    def hit(self, rule, group, ts: float, value=None) -> bool:
+        """
+        Count one matching event (or, for distinct rules, its value); True
+        when it makes the group reach the rule's threshold
+        """
+        window = self.rule_window(rule)
+        if ts > self.latest_ts:
+            self.latest_ts = ts
+        key = (rule.id, group)
+        entry = self.counters.get(key)
+        if entry is None:
+            entry = (window.counter(window.buckets), window)
+            self.counters[key] = entry
+            window.keys += 1
+            self.evict()
+        else:
+            self.counters.move_to_end(key)
+
+        counter = entry[0]
+        bucket = int(ts // window.bucket_s)
+        total = counter.add(bucket) if value is None else counter.add(bucket, value)
+
+        if total is not None and total >= window.count and bucket >= counter.suppressed_until:
+            counter.suppressed_until = bucket + window.buckets
+            window.alerts += 1
+            return True
+        return False
+
+    async def hit_many(self, hits: list) -> list:
+        """
+        hit() for a batch of (rule, group, ts, value) tuples, with the same
+        interface as the shared Redis backend
+        """
+        return [self.hit(*hit) for hit in hits]
+
+    def evict(self):
+        counters = self.counters
+        while counters:
+            key, (counter, window) = next(iter(counters.items()))
+            idle = counter.head is not None and (counter.head + window.buckets) * window.bucket_s <= self.latest_ts
+            if len(counters) <= self.max_keys and not idle:
+                return
+            del counters[key]
+            window.keys -= 1
+            if not idle:
+                window.evicted += 1
+
+    def memory_report(self) -> dict:
+        """
+        rule_id -> live keys, evicted keys, alerts and approximate bytes
+        """
+        per_key = {}
+        values = {}
+        for (rule_id, _), (counter, window) in self.counters.items():
+            if window.counter is DistinctCounter:
+                values[rule_id] = values.get(rule_id, 0) + counter.size()
+
+        report = {}
+        for rule_id, window in self.rules.items():
+            if window.buckets not in per_key:
+                sample = WindowCounter(window.buckets)
+                # counter object + its ring list + the LRU key tuple and slot
+                per_key[window.buckets] = (
+                    sys.getsizeof(sample) + sys.getsizeof(sample.counts) + sys.getsizeof((rule_id, "")) + 100
+                )
+            report[rule_id] = {
+                "keys": window.keys,
+                "evicted": window.evicted,
+                "alerts": window.alerts,
+                # distinct rules: plus a set entry (~60 bytes) per value held
+                "approx_bytes": window.keys * per_key[window.buckets] + values.get(rule_id, 0) * 60,
+            }
+        return report
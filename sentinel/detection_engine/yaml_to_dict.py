@@ -6,5 +6,8 @@ def load_rule(rule_path: str) -> dict:
         return yaml.safe_load(f)
 
 
-print("loading rule")
-print(load_rule("/Users/admin/Desktop/Termtrix-Sentinel/Termtrix-Sentinel/sentinel/rules/nginx/path_traversal.yaml"))
\ No newline at end of file
+if __name__ == "__main__":
+    import sys
+
+    for path in sys.argv[1:]:
+        print(load_rule(path))
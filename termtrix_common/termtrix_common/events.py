@@ -0,0 +1,157 @@
+import json
+from dataclasses import dataclass, fields
+from datetime import datetime
+from hashlib import blake2b
+from operator import attrgetter
+from uuid import UUID
+
+try:
+    import orjson
+except ImportError:  # stdlib json fallback
+    orjson = None
+
+
+@dataclass(slots=True)
+class NormalizedEvent:
+    """
+    The normalized event shared by the normalizer, the ClickHouse writer and
+    the detection engine.
+    """
+    event_id: UUID
+    ts: datetime
+    log_origin: str
+    source: str
+    level: str
+    service: str
+    message: str | None = None
+    event_type: str | None = None
+
+    src_ip: str | None = None
+    dest_ip: str | None = None
+    src_port: int | None = None
+    dest_port: int | None = None
+    protocol: str | None = None
+
+    http_status: int | None = None
+    user_agent: str | None = None
+
+    flow_id: int | None = None
+    flow_state: str | None = None
+    flow_reason: str | None = None
+    flow_age: int | None = None
+    bytes_toserver: int | None = None
+    bytes_toclient: int | None = None
+    pkts_toserver: int | None = None
+    pkts_toclient: int | None = None
+    alerted: bool | None = None
+
+    # original ingest payload, carried next to the encoded event (never inside
+    # it): as text, as a zstd frame, or as a key into the raw blob store
+    # (see termtrix_common.raw_payloads)
+    raw_json: str | None = None
+    raw_zstd: bytes | None = None
+    raw_ref: str | None = None
+
+    def get(self, name: str, default=None):
+        """
+        dict-style access so rule code can treat events and dicts alike
+        """
+        return getattr(self, name, default)
+
+
+EVENT_FIELDS = tuple(f.name for f in fields(NormalizedEvent))
+RAW_FIELDS = ("raw_json", "raw_zstd", "raw_ref")
+_ENCODED_FIELDS = tuple(name for name in EVENT_FIELDS if name not in RAW_FIELDS)
+_FIELD_SET = frozenset(EVENT_FIELDS)
+
+
+# ClickHouse column order for sentinel_logs (see worker/schema.py). to_row()
+# and the insert's column_names both come from here.
+STORAGE_COLUMNS = (
+    "event_id",
+    "ts",
+    "log_origin",
+    "source",
+    "level",
+    "service",
+    "event_type",
+    "message",
+
+    "src_ip",
+    "dest_ip",
+    "src_port",
+    "dest_port",
+    "protocol",
+
+    "http_status",
+    "user_agent",
+
+    "flow_id",
+    "flow_state",
+    "flow_reason",
+    "flow_age",
+    "bytes_toserver",
+    "bytes_toclient",
+    "pkts_toserver",
+    "pkts_toclient",
+    "alerted",
+
+    "raw_json",
+    "raw_zstd",
+    "raw_ref",
+)
+
+to_row = attrgetter(*STORAGE_COLUMNS)
+
+
+# ---------------- IDS ----------------
+
+def event_id_for(source: str, ts: datetime | None, raw) -> UUID:
+    """
+    Content-derived event ID: a 128-bit blake2b of source, timestamp and the
+    raw payload, so a redelivered entry normalizes to the same ID.
+    """
+    if isinstance(raw, str):
+        raw = raw.encode()
+    stamp = ts.isoformat() if ts is not None else ""
+    digest = blake2b(f"{source}\x1f{stamp}\x1f".encode() + raw, digest_size=16).digest()
+    return UUID(bytes=digest)
+
+
+# ---------------- CODEC ----------------
+
+def _json_default(value):
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def encode_event(event: NormalizedEvent):
+    """
+    NormalizedEvent → JSON (bytes with orjson, str with stdlib json).
+    None fields and the raw payload fields are left out.
+    """
+    doc = {}
+    for name in _ENCODED_FIELDS:
+        value = getattr(event, name)
+        if value is not None:
+            doc[name] = value
+    if orjson is not None:
+        return orjson.dumps(doc)
+    return json.dumps(doc, default=_json_default, separators=(",", ":"))
+
+
+def decode_event(payload) -> NormalizedEvent:
+    """
+    JSON → NormalizedEvent, restoring UUID and datetime types
+    """
+    doc = orjson.loads(payload) if orjson is not None else json.loads(payload)
+    doc["event_id"] = UUID(doc["event_id"])
+    doc["ts"] = datetime.fromisoformat(doc["ts"])
+    try:
+        return NormalizedEvent(**doc)
+    except TypeError:
+        # written by a newer producer: ignore fields we don't know yet
+        return NormalizedEvent(**{k: v for k, v in doc.items() if k in _FIELD_SET})
@@ -0,0 +1,203 @@
+import base64
+import os
+import threading
+import time
+from hashlib import blake2b
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:  # optional: only the zstd and blob modes need it
+    zstandard = None
+
+
+# ---------------- CONFIG ----------------
+#
+# How the original ingest payload travels next to a normalized event:
+#
+#   inline  "raw" stream field with the text as-is, stored in raw_json
+#   zstd    "raw_z" stream field with the zstd frame (base64), stored in raw_zstd
+#   blob    zstd frame written to a content-addressed store; only the
+#           "raw_ref" key travels in the stream and is stored in raw_ref
+#
+# Every process that decodes stored payloads (search API, archive readers)
+# needs the same dictionaries and blobs as the normalizer, so RAW_DICT_DIR
+# and RAW_BLOB_DIR must be shared storage (the raw_payloads volume in
+# docker-compose.yml). Blobs are deleted once they are older than the
+# sentinel_logs TTL, as no row can reference them any more.
+
+RAW_PAYLOAD_MODE = os.getenv("RAW_PAYLOAD_MODE", "inline")
+RAW_ZSTD_LEVEL = int(os.getenv("RAW_ZSTD_LEVEL", 3))
+RAW_DICT_DIR = os.getenv("RAW_DICT_DIR", "./raw_dicts")
+RAW_BLOB_DIR = os.getenv("RAW_BLOB_DIR", "./raw_blobs")
+RAW_BLOB_RETENTION_DAYS = int(os.getenv("RAW_BLOB_RETENTION_DAYS", os.getenv("SENTINEL_LOGS_TTL_DAYS", 90)))
+
+RAW_MODES = ("inline", "zstd", "blob")
+DICT_SUFFIX = ".zdict"
+DICT_SIZE = 112640   # zstd's default dictionary size
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("compressed raw payloads need zstandard (pip install zstandard)")
+
+
+class RawCompressor:
+    """
+    zstd for raw payloads, with an optional trained dictionary per event
+    source (RAW_DICT_DIR/<source>.<dict_id>.zdict, newest file per source
+    wins). Small JSON documents share most of their structure, so a
+    dictionary is what makes them compress well. Frames record their
+    dictionary ID, which is how decompress() picks the dictionary back, so
+    older dictionaries must be kept for as long as rows use them.
+
+    zstd contexts are not thread-safe: decompress() is serialized for
+    readers such as the search API, compress() is meant for a single
+    normalizer thread.
+    """
+
+    def __init__(self, dict_dir: str = RAW_DICT_DIR, level: int = RAW_ZSTD_LEVEL):
+        _require_zstandard()
+        self.level = level
+        self.default = zstandard.ZstdCompressor(level=level)
+        self.compressors = {}
+        self.decompressors = {0: zstandard.ZstdDecompressor()}
+        self.lock = threading.Lock()
+
+        directory = Path(dict_dir)
+        paths = directory.glob(f"*{DICT_SUFFIX}") if directory.is_dir() else []
+        for path in sorted(paths, key=lambda p: p.stat().st_mtime):
+            dictionary = zstandard.ZstdCompressionDict(path.read_bytes())
+            source = path.name.split(".")[0]
+            self.compressors[source] = zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+            self.decompressors[dictionary.dict_id()] = zstandard.ZstdDecompressor(dict_data=dictionary)
+
+    def compress(self, source: str, raw) -> bytes:
+        if isinstance(raw, str):
+            raw = raw.encode()
+        return self.compressors.get(source, self.default).compress(raw)
+
+    def decompress(self, frame: bytes) -> str:
+        dict_id = zstandard.get_frame_parameters(frame).dict_id
+        decompressor = self.decompressors.get(dict_id)
+        if decompressor is None:
+            raise ValueError(f"raw payload needs zstd dictionary {dict_id}, not found in the dictionary dir")
+        with self.lock:
+            return decompressor.decompress(frame).decode()
+
+
+def train_dictionary(source: str, samples: list, dict_dir: str = RAW_DICT_DIR, size: int = DICT_SIZE) -> Path:
+    """
+    Train a zstd dictionary from sample payloads of one source and save it
+    next to the existing ones. Compressors pick it up on their next start.
+    """
+    _require_zstandard()
+    samples = [s.encode() if isinstance(s, str) else s for s in samples]
+    dictionary = zstandard.train_dictionary(size, samples)
+    directory = Path(dict_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{source}.{dictionary.dict_id()}{DICT_SUFFIX}"
+    path.write_bytes(dictionary.as_bytes())
+    return path
+
+
+class BlobStore:
+    """
+    Content-addressed file store: a blob's key is the blake2b of its bytes,
+    so repeated payloads are stored once. Files are fanned out over two
+    directory levels and written via rename, never partially visible.
+
+    A blob's mtime is refreshed whenever it is stored again, so it is
+    always younger than the newest row referencing it and sweep() can
+    expire blobs by age alone.
+    """
+
+    def __init__(self, directory: str = RAW_BLOB_DIR):
+        self.directory = Path(directory)
+
+    def path(self, key: str) -> Path:
+        return self.directory / key[:2] / key[2:4] / key
+
+    def put(self, data: bytes) -> str:
+        key = blake2b(data, digest_size=20).hexdigest()
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{key}.{os.getpid()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        return key
+
+    def get(self, key: str) -> bytes:
+        return self.path(key).read_bytes()
+
+    def sweep(self, retention_days: int = RAW_BLOB_RETENTION_DAYS) -> int:
+        """
+        Delete blobs (and leftover temp files) not stored for retention_days,
+        return how many were removed
+        """
+        cutoff = time.time() - retention_days * 86400
+        removed = 0
+        if not self.directory.is_dir():
+            return removed
+        for first in os.scandir(self.directory):
+            if not first.is_dir():
+                continue
+            for second in os.scandir(first.path):
+                if not second.is_dir():
+                    continue
+                for entry in os.scandir(second.path):
+                    try:
+                        if entry.stat().st_mtime < cutoff:
+                            os.unlink(entry.path)
+                            removed += 1
+                    except FileNotFoundError:
+                        pass   # swept by another process
+        return removed
+
+
+class RawPayloads:
+    """
+    Encodes raw payloads into stream fields for the configured mode and
+    turns any stored form back into text. Decoding works whatever mode
+    wrote the event, so the mode can change while events are in flight.
+    """
+
+    def __init__(self, mode: str = RAW_PAYLOAD_MODE, dict_dir: str = RAW_DICT_DIR, blob_dir: str = RAW_BLOB_DIR):
+        if mode not in RAW_MODES:
+            raise ValueError(f"unknown raw payload mode {mode!r}, expected one of {', '.join(RAW_MODES)}")
+        self.mode = mode
+        self.dict_dir = dict_dir
+        self.blobs = BlobStore(blob_dir)
+        self._compressor = None
+
+    @property
+    def compressor(self) -> RawCompressor:
+        # built on first use, so inline mode never needs zstandard
+        if self._compressor is None:
+            self._compressor = RawCompressor(self.dict_dir)
+        return self._compressor
+
+    def stream_fields(self, source: str, raw) -> dict:
+        if raw is None:
+            return {}
+        if self.mode == "inline":
+            return {"raw": raw}
+        frame = self.compressor.compress(source, raw)
+        if self.mode == "zstd":
+            return {"raw_z": base64.b64encode(frame).decode()}
+        return {"raw_ref": self.blobs.put(frame)}
+
+    def text(self, raw_json: str | None = None, raw_zstd: bytes | None = None, raw_ref: str | None = None) -> str | None:
+        """
+        The original payload from whichever form was stored
+        """
+        if raw_json:
+            return raw_json
+        if raw_zstd:
+            return self.compressor.decompress(raw_zstd)
+        if raw_ref:
+            return self.compressor.decompress(self.blobs.get(raw_ref))
+        return None
@@ -0,0 +1,117 @@
+import time
+
+from termtrix_common.termtrix_common import topology
+
+
+class PendingReclaimer:
+    """
+    Recovers entries stuck in a consumer group's PEL.
+
+    Entries idle for longer than min_idle_ms (their consumer crashed or kept
+    failing on them) are taken over with XAUTOCLAIM and handed back to the
+    caller for reprocessing. Entries already delivered max_deliveries times
+    are treated as poison: copied to the dead-letter stream and ACKed so they
+    stop cycling through the PEL.
+    """
+
+    def __init__(
+        self,
+        redis,
+        stream: str,
+        group: str,
+        consumer: str,
+        dead_letter_stream: str | None = None,
+        min_idle_ms: int = 60000,
+        max_deliveries: int = 5,
+        batch_size: int = 100,
+        interval_s: float = 30,
+        dead_letter_maxlen: int = 100000,
+    ):
+        self.redis = redis
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self.dead_letter_stream = dead_letter_stream or topology.dead_letter_stream(stream)
+        self.min_idle_ms = min_idle_ms
+        self.max_deliveries = max_deliveries
+        self.batch_size = batch_size
+        self.interval_s = interval_s
+        self.dead_letter_maxlen = dead_letter_maxlen
+
+        self.cursor = "0-0"
+        self.last_run = 0.0
+        self.reclaimed = 0
+        self.dead_lettered = 0
+
+    def due(self) -> bool:
+        return time.monotonic() - self.last_run >= self.interval_s
+
+    async def reclaim(self) -> list:
+        """
+        One XAUTOCLAIM sweep step. Returns [(msg_id, fields)] to reprocess.
+        """
+        self.last_run = time.monotonic()
+
+        result = await self.redis.xautoclaim(
+            self.stream,
+            self.group,
+            self.consumer,
+            min_idle_time=self.min_idle_ms,
+            start_id=self.cursor,
+            count=self.batch_size,
+        )
+        # Redis >= 7 also returns IDs that were trimmed from the stream;
+        # XAUTOCLAIM has already removed those from the PEL.
+        self.cursor, entries = result[0], result[1]
+        entries = [(msg_id, fields) for msg_id, fields in entries if fields is not None]
+        if not entries:
+            return []
+
+        deliveries = await self.delivery_counts([msg_id for msg_id, _ in entries])
+
+        retry = []
+        poison = []
+        for msg_id, fields in entries:
+            if deliveries.get(msg_id, 0) > self.max_deliveries:
+                poison.append((msg_id, fields))
+            else:
+                retry.append((msg_id, fields))
+
+        if poison:
+            await self.dead_letter(poison, deliveries)
+
+        self.reclaimed += len(retry)
+        return retry
+
+    async def delivery_counts(self, msg_ids: list) -> dict:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for msg_id in msg_ids:
+                pipe.xpending_range(self.stream, self.group, min=msg_id, max=msg_id, count=1)
+            results = await pipe.execute()
+
+        return {
+            info["message_id"]: info["times_delivered"]
+            for rows in results
+            for info in rows
+        }
+
+    async def dead_letter(self, entries: list, deliveries: dict):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for msg_id, fields in entries:
+                pipe.xadd(
+                    self.dead_letter_stream,
+                    {
+                        **fields,
+                        "dlq_stream": self.stream,
+                        "dlq_group": self.group,
+                        "dlq_id": msg_id,
+                        "dlq_deliveries": deliveries.get(msg_id, 0),
+                    },
+                    maxlen=self.dead_letter_maxlen,
+                    approximate=True,
+                )
+            pipe.xack(self.stream, self.group, *[msg_id for msg_id, _ in entries])
+            await pipe.execute()
+
+        self.dead_lettered += len(entries)
+        print(f"Dead-lettered {len(entries)} entries from {self.stream}/{self.group} to {self.dead_letter_stream}")
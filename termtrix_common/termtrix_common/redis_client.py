@@ -1,6 +1,14 @@
 from redis.asyncio import Redis
 # from app.logger import logger
 
+from termtrix_common.termtrix_common.topology import (
+    DETECTION_GROUP,
+    NORMALIZED_STREAM,
+    NORMALIZER_GROUP,
+    RAW_STREAM,
+    ensure_topology,
+)
+
 
 redis_client = Redis(
     host="redis-server",
@@ -11,18 +19,14 @@ redis_client = Redis(
 
 # create consumer group
 
-STREAM = "sentinel:logs"
-GROUP = "sentinel-consumers"
+STREAM = RAW_STREAM
+GROUP = NORMALIZER_GROUP
 
 # FOR DETECTION ENGINE
 
-NORMALIZED_EVENT = "normalized:events"
-EVENT_GROUP = "detection-engine"
+NORMALIZED_EVENT = NORMALIZED_STREAM
+EVENT_GROUP = DETECTION_GROUP
 EVENT_CONSUMER = "dectector-1"
 
 async def create_consumer_group():
-    try:
-        await redis_client.xgroup_create(STREAM, GROUP, mkstream=True)
-        await redis_client.xgroup_create(NORMALIZED_EVENT,EVENT_GROUP,mkstream=True)
-    except Exception as e:
-        print("Consumer group already exists")
\ No newline at end of file
+    await ensure_topology(redis_client)
@@ -0,0 +1,41 @@
+from redis.exceptions import ResponseError
+
+
+# ---------------- STREAMS ----------------
+#
+#   /internal/logs ──> RAW_STREAM ──(normalizer)──> NORMALIZED_STREAM ─┬─(detection)
+#                                                                       └─(storage)
+#
+# The normalizer writes every event exactly once; detection and storage are
+# independent consumer groups fanning out from the same normalized stream.
+
+RAW_STREAM = "sentinel:logs"
+NORMALIZED_STREAM = "normalized:events"
+
+# ---------------- CONSUMER GROUPS ----------------
+
+NORMALIZER_GROUP = "sentinel-consumers"
+DETECTION_GROUP = "detection-engine"
+STORAGE_GROUP = "clickhouse-writers"
+
+CONSUMER_GROUPS = {
+    RAW_STREAM: (NORMALIZER_GROUP,),
+    NORMALIZED_STREAM: (DETECTION_GROUP, STORAGE_GROUP),
+}
+
+
+def dead_letter_stream(stream: str) -> str:
+    return f"{stream}:dead"
+
+
+async def ensure_topology(redis):
+    """
+    Create every stream and consumer group that doesn't exist yet
+    """
+    for stream, groups in CONSUMER_GROUPS.items():
+        for group in groups:
+            try:
+                await redis.xgroup_create(stream, group, id="$", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
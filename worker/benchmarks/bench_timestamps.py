@@ -0,0 +1,42 @@
+"""
+Micro-benchmark: dateutil.parser.parse (previous normalizer path) vs the
+TimestampParser fast path, on the timestamp shapes each source sends.
+
+    python -m worker.benchmarks.bench_timestamps
+"""
+import timeit
+
+from dateutil.parser import parse
+
+from worker.timestamps import TimestampParser
+
+
+SAMPLES = {
+    "application": "2025-12-31T07:11:36.578784Z",
+    "nginx": "2025-12-31T12:34:54+05:30",
+    "suricata": "2025-12-31T12:34:54.466448+0530",
+    "fallback": "Dec 31 2025 12:34:54 +0530",
+}
+
+NUMBER = 50000
+
+
+def main():
+    parser = TimestampParser()
+
+    print(f"{'source':<12} {'dateutil':>12} {'fast':>12} {'speedup':>8}")
+    for source, value in SAMPLES.items():
+        assert parser.parse(value, source) == parse(value)
+        baseline = timeit.timeit(lambda: parse(value), number=NUMBER)
+        fast = timeit.timeit(lambda: parser.parse(value, source), number=NUMBER)
+
+        print(
+            f"{source:<12} {baseline / NUMBER * 1e6:9.2f} us {fast / NUMBER * 1e6:9.2f} us"
+            f" {baseline / fast:7.1f}x"
+        )
+
+    print("hits/misses:", parser.stats())
+
+
+if __name__ == "__main__":
+    main()
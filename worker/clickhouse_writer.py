@@ -1,171 +1,433 @@
 import asyncio
-import json
-from uuid import UUID
-from dateutil.parser import isoparse
-
-import redis.asyncio as redis
-
-from worker.storage import connection
+import os
+import signal
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from hashlib import blake2b
+
+from worker.serializer import EventSerializer
+from worker.metrics import Metrics
+from worker.columnar import ColumnBatch
+from worker.sinks import SENTINEL_SINK, StorageSink, make_sink
+from worker.spill import SpillBuffer
 from termtrix_common.termtrix_common.redis_client import redis_client
+from termtrix_common.termtrix_common.reclaimer import PendingReclaimer
+from termtrix_common.termtrix_common.topology import NORMALIZED_STREAM, STORAGE_GROUP, ensure_topology
 
 
 # ---------------- CONFIG ----------------
 
-REDIS_STREAM = "sentinel:logs:normalized"
-REDIS_GROUP = "clickhouse-writers"
-CONSUMER_NAME = "writer-1"
+REDIS_STREAM = NORMALIZED_STREAM
+REDIS_GROUP = STORAGE_GROUP
+CONSUMER_NAME = os.getenv("CONSUMER_NAME", "writer-1")
 
-BATCH_SIZE = 500
+BATCH_SIZE = 500   # max entries per XREADGROUP
 BLOCK_MS = 5000
 
-CLICKHOUSE_DB = "default"
-CLICKHOUSE_TABLE = "sentinel_logs"
+# Local write-ahead spill used while the sink is unavailable
+SPILL_DIR = os.getenv("SPILL_DIR", "./spill")
+SPILL_SEGMENT_BYTES = int(os.getenv("SPILL_SEGMENT_BYTES", 64 * 1024 * 1024))
+SPILL_MAX_BYTES = int(os.getenv("SPILL_MAX_BYTES", 4 * 1024 * 1024 * 1024))
+REPLAY_INTERVAL_S = 10
+REPLAY_MAX_ROWS = 200000   # spilled batches are merged into inserts of up to this many rows
+MAX_BACKOFF_S = 30
 
 
-def to_row(event: dict) -> tuple:
+def dedup_token(event_ids) -> str:
     """
-    Convert normalized event dict → ClickHouse row tuple
-    Order MUST match table schema
+    Insert deduplication token of a batch, derived from the event IDs of
+    its rows in sorted order. A retry of the same events gets the same
+    token whatever stream entries and order they were redelivered with;
+    a retry regrouped with other events does not, so dedup only covers
+    redelivery of the whole batch.
     """
+    digest = blake2b(digest_size=16)
+    for event_id in sorted(event_ids):
+        digest.update(event_id.bytes)
+    return digest.hexdigest()
 
 
-    row = (
-    event["event_id"],
-    event["ts"],
-    event["log_origin"],
-    event["source"],
-    event["level"],
-    event["service"],
-    event["message"],
-
-    event.get("src_ip"),
-    event.get("event_type"),
-    # event.get("dest_ip"),
-    # event.get("http_status"),
-    # event.get("user_agent"),
-    # event.get("src_port"),
-    # event.get("dest_port"),
-    # event.get("protocol"),
-
-  
-    # event.get("flow_id"),
-    # event.get("flow_state"),
-    # event.get("flow_reason"),
-    # event.get("flow_age"),
-    # event.get("bytes_toserver"),
-    # event.get("bytes_toclient"),
-    # event.get("pkts_toserver"),
-    # event.get("pkts_toclient"),
-    event.get("alerted"),
-
-    # event["raw_json"],
-)
-
-    return row
-
-
-
+@dataclass
+class FlushPolicy:
+    """
+    Rows accumulate across reads and are inserted when whichever limit is hit
+    first: row count, encoded size, or age of the oldest buffered row.
+    """
+    max_rows: int = int(os.getenv("FLUSH_MAX_ROWS", 50000))
+    max_bytes: int = int(os.getenv("FLUSH_MAX_BYTES", 32 * 1024 * 1024))
+    max_linger_s: float = float(os.getenv("FLUSH_MAX_LINGER_MS", 5000)) / 1000
 
+    def flush_reason(self, rows: int, nbytes: int, age_s: float) -> str | None:
+        if rows >= self.max_rows:
+            return "rows"
+        if nbytes >= self.max_bytes:
+            return "bytes"
+        if rows and age_s >= self.max_linger_s:
+            return "linger"
+        return None
 
 
 class ClickHouseWriter:
-    def __init__(self):
-        self.client = connection.client
-        self.buffer = []
+    def __init__(
+        self,
+        consumer_name: str = CONSUMER_NAME,
+        policy: FlushPolicy | None = None,
+        sink: StorageSink | None = None,
+    ):
+        self.consumer_name = consumer_name
+        self.sink = sink or make_sink(consumer_name=consumer_name)
+        self.policy = policy or FlushPolicy()
+        self.metrics = Metrics(f"writer:{consumer_name}")
+        self.buffer = ColumnBatch()
         self.ack_ids = []
-    
+        self.buffer_bytes = 0
+        self.buffer_started = 0.0
 
-    async def consume_and_insert(self):
-        while True:
-            messages = await redis_client.xreadgroup(
-            groupname=REDIS_GROUP,
-            consumername=CONSUMER_NAME,
-            streams={REDIS_STREAM: ">"},
-            count=BATCH_SIZE,
-            block=BLOCK_MS,
-        )
+        # Double buffering: one batch is inserted on the executor thread while
+        # the next one fills from Redis. A single thread keeps inserts ordered
+        # and the (non thread-safe) sink used by one write at a time.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sink-write")
+        self.inflight: asyncio.Task | None = None
 
-            if not messages:
-                continue
+        # one spill directory per consumer; only ever touched from the executor thread
+        self.spill = SpillBuffer(os.path.join(SPILL_DIR, consumer_name), SPILL_SEGMENT_BYTES, SPILL_MAX_BYTES)
+        self.last_replay = 0.0
 
-            for _, entries in messages:
-                for msg_id, fields in entries:
-                    try:
-                        event = json.loads(fields["payload"])
-                        # print("event ==>",event)
-                        self.buffer.append(to_row(event))
-                        self.ack_ids.append(msg_id)
-                    except Exception as e:
+        # ACKs of batches a buffering sink (parquet) has not made durable yet
+        self.uncommitted_ids = []
+        self.uncommitted_since = 0.0
 
-                        print("Bad event skipped:", e)
+        self.running = True
+    
 
-            assert all(isinstance(e, tuple) for e in self.buffer)
+    def buffer_entries(self, entries):
+        for msg_id, fields in entries:
+            try:
+                event = EventSerializer.from_stream_fields(fields)
+                # print("event ==>",event)
+                self.buffer.append(event)
+                self.ack_ids.append(msg_id)
+            except Exception as e:
+                self.metrics.incr("bad_events")
+                print("Bad event skipped:", e)
+                continue
 
-            if self.buffer:
+            if len(self.buffer) == 1:
+                self.buffer_started = time.monotonic()
+            self.buffer_bytes += sum(map(len, fields.values()))
+
+    def buffer_age(self) -> float:
+        return time.monotonic() - self.buffer_started if self.buffer else 0.0
+
+    def block_ms(self) -> int:
+        """
+        Never block past the linger deadline of what is already buffered
+        (and never pass 0, which would block forever)
+        """
+        if not self.buffer:
+            return BLOCK_MS
+        remaining_ms = (self.policy.max_linger_s - self.buffer_age()) * 1000
+        return max(1, min(BLOCK_MS, int(remaining_ms)))
+
+    async def flush(self, reason: str):
+        """
+        Hand the current buffer to the insert thread and start a fresh one.
+        Waits only if the previous batch is still being written.
+        """
+        # a failure of the previous insert surfaces here, before the buffer is handed off
+        await self.wait_inflight()
+
+        rows, ack_ids, nbytes = self.buffer, self.ack_ids, self.buffer_bytes
+        rows.dedup_token = dedup_token(rows.column("event_id"))
+        self.buffer = ColumnBatch()
+        self.ack_ids = []
+        self.buffer_bytes = 0
+        self.inflight = asyncio.create_task(self.insert_batch(rows, ack_ids, nbytes, reason))
+
+    async def wait_inflight(self):
+        if self.inflight is not None:
+            inflight, self.inflight = self.inflight, None
+            await inflight
+
+    async def run_in_executor(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def insert_batch(self, rows: ColumnBatch, ack_ids: list, nbytes: int, reason: str):
+        """
+        Store one batch, then ACK it. The batch goes to the sink unless a
+        spill backlog exists (keeps order) or the write fails, in which case
+        it is made durable in the local spill first. If the spill is full
+        the batch is held here, which stalls reading until there is room.
+        """
+        started = time.monotonic()
+        backoff = 1
+        stored = False
+        while True:
+            if not self.spill.pending():
                 try:
-                    self.client.insert(
-                        table=CLICKHOUSE_TABLE,
-                        data=self.buffer,
-                        column_names=[
-                            "event_id",
-                            "ts",
-                            "log_origin",
-                            "source",
-                            "level",
-                            "service",
-                            "message",
-
-                            "src_ip",
-                            "event_type",
-                            # "dest_ip",
-                            # "http_status",
-                            # "user_agent",
-
-                            # "raw_json",
-
-                            # "src_port",
-                            # "dest_port",
-                            # "protocol",
-
-
-                            "alerted",
-                        ]
-                    )
-
-
-                    # ACK only after successful insert
-                    await redis_client.xack(
-                        REDIS_STREAM, REDIS_GROUP, *self.ack_ids
-                    )
-
-                    self.buffer.clear()
-                    self.ack_ids.clear()
-
+                    committed = await self.run_in_executor(self.sink.write, rows)
+                    stored = True
+                    if not committed:
+                        # ACK later, once the sink commits these rows
+                        if not self.uncommitted_ids:
+                            self.uncommitted_since = time.monotonic()
+                        self.uncommitted_ids += ack_ids
+                        ack_ids = []
+                    else:
+                        ack_ids = self.uncommitted_ids + ack_ids
+                        self.uncommitted_ids = []
+                    break
                 except Exception as e:
-                    print("ClickHouse insert failed:", e)
-                    print("FAILED EVENT:", event)
-                    print("FAILED ROW:", to_row(event))
+                    print(f"{self.sink.name} write failed:", e)
+                    self.metrics.incr("insert_failures")
+
+            if await self.run_in_executor(self.spill.append, rows.dumps()):
+                self.metrics.incr("rows_spilled", len(rows))
+                break
+
+            print(f"Spill buffer full ({self.spill.size} bytes), holding {len(rows)} rows")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF_S)
+
+        # ACK only once the batch is durable in the sink or in the spill
+        if ack_ids:
+            await redis_client.xack(
+                REDIS_STREAM, REDIS_GROUP, *ack_ids
+            )
+
+        self.metrics.incr(f"flush_reason.{reason}")
+        if stored:
+            # spilled rows are counted when they are replayed
+            self.metrics.incr("rows_inserted", len(rows))
+        self.metrics.observe("batch_rows", len(rows))
+        self.metrics.observe("batch_bytes", nbytes)
+        self.metrics.observe("insert_seconds", time.monotonic() - started)
+        self.spill_gauges()
+
+    async def maybe_commit(self):
+        """
+        Commit a buffering sink whose oldest un-ACKed rows reached its commit delay
+        """
+        if not self.uncommitted_ids or time.monotonic() - self.uncommitted_since < self.sink.commit_delay_s:
+            return
+        await self.wait_inflight()
+        if not self.uncommitted_ids:
+            return
+        try:
+            await self.run_in_executor(self.sink.commit)
+        except Exception as e:
+            print(f"{self.sink.name} commit failed:", e)
+            self.metrics.incr("commit_failures")
+            self.uncommitted_since = time.monotonic()
+            return
+        ack_ids, self.uncommitted_ids = self.uncommitted_ids, []
+        await redis_client.xack(REDIS_STREAM, REDIS_GROUP, *ack_ids)
+
+    def spill_gauges(self):
+        self.metrics.gauge("spill_bytes", self.spill.size)
+        self.metrics.gauge("spill_segments", self.spill.segments())
+
+    def replay_spill(self, stats: Counter) -> int:
+        """
+        Runs on the executor thread: insert each sealed segment in large
+        merged batches and delete it once all of it is stored. Batches the
+        sink rejects for good are quarantined (counted in stats) so they
+        don't block the rest; any other failure stops the replay, and the
+        segment is retried whole. Rows of stored segments are counted in
+        stats; returns the number of rows replayed.
+
+        Merging restarts at every segment, so a retry after a partial failure
+        rebuilds the same batches with the same deduplication tokens.
+        """
+        self.spill.seal()
+        replayed = 0
+        for path in list(self.spill.sealed):
+            stored = 0
+            merged = []
+            rejected = []    # (payload, batch or None, error), quarantined once the segment is stored
+            for payload in self.spill.read_segment(path):
+                try:
+                    batch = ColumnBatch.loads(payload)
+                except Exception as e:
+                    rejected.append((payload, None, e))
+                    continue
+                rows = sum(len(spilled) for _, spilled in merged)
+                if merged and (merged[0][1].columns != batch.columns or rows + len(batch) > REPLAY_MAX_ROWS):
+                    stored += self.insert_spilled(merged, rejected)
+                    merged = []
+                merged.append((payload, batch))
+            if merged:
+                stored += self.insert_spilled(merged, rejected)
+            self.sink.commit()
+            for payload, batch, error in rejected:
+                self.quarantine(payload, batch, error, stats)
+            self.spill.drop(path)
+            # a segment that fails part way is replayed whole, so count it once done
+            stats["rows_inserted"] += stored
+            replayed += stored
+        return replayed
+
+    def insert_spilled(self, spilled: list, rejected: list) -> int:
+        """
+        Insert [(payload, batch)] as one merged batch. If the sink rejects
+        it for good, retry the batches one by one and add the ones it
+        rejects to `rejected`, so one bad batch costs only itself.
+        """
+        try:
+            return self.insert_merged([batch for _, batch in spilled])
+        except Exception as e:
+            if not self.sink.permanent(e):
+                raise
+            if len(spilled) == 1:
+                rejected.append((*spilled[0], e))
+                return 0
+
+        stored = 0
+        for payload, _ in spilled:
+            # the merge above extended the first batch in place
+            batch = ColumnBatch.loads(payload)
+            try:
+                self.sink.write(batch)
+            except Exception as e:
+                if not self.sink.permanent(e):
                     raise
+                rejected.append((payload, batch, e))
+                continue
+            stored += len(batch)
+        return stored
+
+    def insert_merged(self, batches: list) -> int:
+        merged = batches[0]
+        if len(batches) > 1:
+            for batch in batches[1:]:
+                merged.extend(batch)
+            merged.dedup_token = dedup_token(merged.column("event_id"))
+        self.sink.write(merged)
+        return len(merged)
+
+    def quarantine(self, payload: bytes, batch: ColumnBatch | None, error: Exception, stats: Counter):
+        path = self.spill.quarantine(payload)
+        print(f"{self.sink.name} rejected a spilled batch, quarantined as {path}:", error)
+        stats["batches_quarantined"] += 1
+        if batch is not None:
+            stats["rows_quarantined"] += len(batch)
+
+    async def maybe_replay(self):
+        if time.monotonic() - self.last_replay < REPLAY_INTERVAL_S:
+            return
+        self.last_replay = time.monotonic()
+        # spills left by writers that are gone (e.g. a retired supervisor slot)
+        adopted = await self.run_in_executor(self.spill.adopt_orphans)
+        if adopted:
+            print(f"Adopted {adopted} orphaned spill segments")
+        if not self.spill.pending():
+            return
+        stats = Counter()
+        try:
+            # don't seal a fresh (tiny) segment on every attempt while the sink is down
+            if not await self.run_in_executor(self.sink.ping):
+                return
+            replayed = await self.run_in_executor(self.replay_spill, stats)
+            if replayed:
+                print(f"Replayed {replayed} spilled rows into {self.sink.name}")
+        except Exception as e:
+            print(f"Spill replay failed, {self.sink.name} still unavailable:", e)
+        finally:
+            # counted on the executor thread, reported from this one
+            for key in ("rows_inserted", "batches_quarantined", "rows_quarantined"):
+                if stats[key]:
+                    self.metrics.incr(key, stats[key])
+            self.spill_gauges()
 
-                    await asyncio.sleep(1)  # backoff
+    async def consume_and_insert(self):
+        # entries held for a buffering sink must not look abandoned to the reclaimer
+        min_idle_ms = max(60000, int(self.sink.commit_delay_s * 2000))
+        reclaimer = PendingReclaimer(
+            redis_client, REDIS_STREAM, REDIS_GROUP, self.consumer_name, min_idle_ms=min_idle_ms
+        )
 
+        backoff = 1
+        while self.running:
+            try:
+                if reclaimer.due():
+                    self.buffer_entries(await reclaimer.reclaim())
+
+                if self.metrics.due():
+                    await self.metrics.report(redis_client)
+
+                if self.inflight is not None and self.inflight.done():
+                    await self.wait_inflight()   # surfaces a failed insert
+
+                await self.maybe_replay()
+                await self.maybe_commit()
+
+                reason = self.policy.flush_reason(len(self.buffer), self.buffer_bytes, self.buffer_age())
+                if reason:
+                    await self.flush(reason)
+
+                messages = await redis_client.xreadgroup(
+                    groupname=REDIS_GROUP,
+                    consumername=self.consumer_name,
+                    streams={REDIS_STREAM: ">"},
+                    count=max(1, min(BATCH_SIZE, self.policy.max_rows - len(self.buffer))),
+                    block=self.block_ms(),
+                )
+
+                for _, entries in messages or []:
+                    self.buffer_entries(entries)
+                backoff = 1
+
+            except Exception as e:
+                # Redis down (XREADGROUP/XACK): entries not ACKed stay pending
+                # and are reclaimed, so keep what is buffered and retry
+                print("Writer error:", e)
+                self.metrics.incr("loop_errors")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_S)
+
+        await self.shutdown()
+
+    def stop(self):
+        self.running = False
+
+    async def shutdown(self):
+        """
+        Store what is buffered and ACK what became durable, then seal the
+        spill: this writer replays it when it runs again, and any other
+        writer on the host adopts it otherwise. What could not be stored
+        stays pending in Redis and is reclaimed.
+        """
+        print(f"Writer {self.consumer_name} shutting down")
+        try:
+            if self.buffer:
+                await self.flush("shutdown")
+            await self.wait_inflight()
+            if self.uncommitted_ids:
+                await self.run_in_executor(self.sink.commit)
+                ack_ids, self.uncommitted_ids = self.uncommitted_ids, []
+                await redis_client.xack(REDIS_STREAM, REDIS_GROUP, *ack_ids)
+        except Exception as e:
+            print("Writer shutdown incomplete, un-ACKed entries will be reclaimed:", e)
+        finally:
+            await self.run_in_executor(self.spill.close)
+            self.executor.shutdown()
 
 
 # ---------------- BOOTSTRAP ----------------
 
-async def main():
-    try:
-        await redis_client.xgroup_create(
-            name=REDIS_STREAM,
-            groupname=REDIS_GROUP,
-            id="$",
-            mkstream=True,
-        )
-    except Exception:
-        pass  # group already exists
+async def main(consumer_name: str = CONSUMER_NAME):
+    await ensure_topology(redis_client)
+    writer = ClickHouseWriter(consumer_name)
+    writer.sink.prepare()
 
-    await ClickHouseWriter().consume_and_insert()
+    # SIGTERM (supervisor scale-down, docker stop): finish the current batch
+    signal.signal(signal.SIGTERM, lambda *_: writer.stop())
+    signal.signal(signal.SIGINT, lambda *_: writer.stop())
+    await writer.consume_and_insert()
 
 if __name__ == "__main__":
-    print("ClickHouse writer started")
+    print(f"Storage writer started ({SENTINEL_SINK} sink)")
     asyncio.run(main())
@@ -0,0 +1,153 @@
+import pickle
+from array import array
+from functools import lru_cache
+from ipaddress import IPv6Address, ip_address
+from operator import attrgetter
+
+from termtrix_common.termtrix_common.events import STORAGE_COLUMNS
+
+
+# Numeric columns are accumulated in typed arrays (one machine value per row,
+# no per-row Python objects kept alive). The table stores them non-nullable
+# with DEFAULT 0, so a missing value is written as 0.
+NUMERIC_TYPECODES = {
+    "src_port": "H",
+    "dest_port": "H",
+    "http_status": "H",
+    "flow_id": "Q",
+    "flow_age": "Q",
+    "bytes_toserver": "Q",
+    "bytes_toclient": "Q",
+    "pkts_toserver": "Q",
+    "pkts_toclient": "Q",
+    "alerted": "B",
+}
+
+# String columns are non-nullable too: None is written as ''.
+STRING_COLUMNS = frozenset({
+    "log_origin",
+    "source",
+    "level",
+    "service",
+    "event_type",
+    "message",
+    "protocol",
+    "user_agent",
+    "flow_state",
+    "flow_reason",
+    "raw_json",
+    "raw_ref",
+})
+
+UNSPECIFIED_IP = IPv6Address("::")
+
+
+@lru_cache(maxsize=65536)
+def to_ipv6(value) -> IPv6Address:
+    """
+    Any IP string -> IPv6Address for the IPv6 columns (IPv4 is stored
+    IPv4-mapped). Missing or unparsable addresses become '::'.
+    Cached because the same handful of addresses repeat across events.
+    """
+    if not value:
+        return UNSPECIFIED_IP
+    try:
+        address = ip_address(value)
+    except ValueError:
+        return UNSPECIFIED_IP
+    if address.version == 4:
+        return IPv6Address(f"::ffff:{address}")
+    return address
+
+
+def _or_zero(value):
+    return value or 0
+
+
+def _or_empty(value):
+    return "" if value is None else value
+
+
+def _or_empty_bytes(value):
+    return b"" if value is None else value
+
+
+CONVERTERS = {
+    "src_ip": to_ipv6,
+    "dest_ip": to_ipv6,
+    **{name: _or_zero for name in NUMERIC_TYPECODES},
+    **{name: _or_empty for name in STRING_COLUMNS},
+    "raw_zstd": _or_empty_bytes,
+}
+
+
+class ColumnBatch:
+    """
+    Column-oriented insert buffer: every event is appended field by field
+    straight into per-column arrays, ready for client.insert(column_oriented=True).
+    """
+
+    def __init__(self, columns: tuple = STORAGE_COLUMNS):
+        self.columns = columns
+        self.data = [
+            array(NUMERIC_TYPECODES[name]) if name in NUMERIC_TYPECODES else []
+            for name in columns
+        ]
+        self.appenders = [
+            (attrgetter(name), column.append, CONVERTERS.get(name))
+            for name, column in zip(columns, self.data)
+        ]
+        self.rows = 0
+        self.dedup_token = None   # insert_deduplication_token, set when the batch is sealed
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def append(self, event):
+        try:
+            for get, append, convert in self.appenders:
+                value = get(event)
+                append(convert(value) if convert is not None else value)
+        except Exception:
+            self.rollback()
+            raise
+        self.rows += 1
+
+    def rollback(self):
+        """
+        Drop a partially appended row so the columns stay aligned
+        """
+        for column in self.data:
+            del column[self.rows:]
+
+    def column_names(self) -> list:
+        return list(self.columns)
+
+    def column(self, name: str):
+        return self.data[self.columns.index(name)]
+
+    def extend(self, other: "ColumnBatch"):
+        """
+        Append every row of another batch with the same columns
+        """
+        if other.columns != self.columns:
+            raise ValueError("cannot merge batches with different columns")
+        for column, values in zip(self.data, other.data):
+            column.extend(values)
+        self.rows += other.rows
+
+    def dumps(self) -> bytes:
+        """
+        Serialized form for the local spill log (never leaves this host)
+        """
+        return pickle.dumps((self.columns, self.data, self.rows, self.dedup_token), protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def loads(cls, payload: bytes) -> "ColumnBatch":
+        columns, data, rows, dedup_token = pickle.loads(payload)
+        batch = cls(tuple(columns))
+        for column, values in zip(batch.data, data):
+            column.extend(values)
+        batch.rows = rows
+        batch.dedup_token = dedup_token
+        return batch
@@ -3,24 +3,39 @@ from termtrix_common.termtrix_common.redis_client import redis_client
 import asyncio
 import signal
 import json
+import os
+import time
 
 from worker.normailzer import SentinelNormlizer
-from worker.storage import connection
 from worker.serializer import EventSerializer
+from termtrix_common.termtrix_common.raw_payloads import RawPayloads
+from termtrix_common.termtrix_common.reclaimer import PendingReclaimer
+from termtrix_common.termtrix_common.topology import (
+    NORMALIZED_STREAM,
+    NORMALIZER_GROUP,
+    RAW_STREAM,
+    ensure_topology,
+)
 
 # from sentinel.detection_engine.termtrix_detection_engine import TermtrixDetectionEngine
 
 # t = TermtrixDetectionEngine()
 # print(t.NGINX_RULES)
 
-STREAM = "sentinel:logs"
-GROUP = "sentinel-consumers"
-CONSUMER = "worker-1"
+STREAM = RAW_STREAM
+GROUP = NORMALIZER_GROUP
+CONSUMER = os.getenv("CONSUMER_NAME", "worker-1")
+
+BATCH_SIZE = 100
+BLOCK_MS = 5000
+STATS_INTERVAL_S = 60
+BLOB_SWEEP_INTERVAL_S = int(os.getenv("RAW_BLOB_SWEEP_INTERVAL_S", 3600))
 
 
 
 running = True
 normailzer = SentinelNormlizer()
+raw_payloads = RawPayloads()
 
 
 def shutdown():
@@ -31,60 +46,105 @@ signal.signal(signal.SIGTERM, lambda *_: shutdown())
 signal.signal(signal.SIGINT, lambda *_: shutdown())
 
 
-async def process_log(log: dict):
+def decode_entries(entries: list):
     """
-    DO NOT BLOCK HERE
-    Offload heavy work to background tasks if needed
+    Split a batch into decodable events and entries whose payload is broken.
+    The raw payload strings are kept as-is for passthrough.
     """
-    # print("Processing:", log)
+    ids = []
+    events = []
+    raws = []
+    for msg_id, data in entries:
+        try:
+            events.append(json.loads(data["payload"]))
+            ids.append(msg_id)
+            raws.append(data["payload"])
+        except Exception as e:
+            # DO NOT ACK on failure
+            print("Error decoding", msg_id, e)
+    return ids, events, raws
 
-    raw_event = json.loads(log["payload"]) 
-    # store / analyze / enrich
-    # sentinel = raw_event.get("sentinel")
 
-    # print("sentinel ==>",raw_event)
+async def process_batch(entries: list) -> list:
+    """
+    Normalize a whole XREADGROUP batch in one call, then write every
+    normalized event and ACK every successful entry in a single MULTI/EXEC
+    round trip. Failed entries are left un-ACKed in the PEL.
+    """
+    ids, events, raws = decode_entries(entries)
+    results = normailzer.normalize_batch(events, raws)
+
+    ack_ids = []
+    payloads = []
+    for msg_id, result, raw in zip(ids, results, raws):
+        if isinstance(result, Exception):
+            # DO NOT ACK on failure
+            print("Error processing", msg_id, result)
+            continue
+        if result is not None:
+            try:
+                payloads.append(EventSerializer.to_stream_fields(result, raw, raw_payloads))
+            except Exception as e:
+                print("Error serializing", msg_id, e)
+                continue
+        ack_ids.append(msg_id)
 
-    normalized_event = await normailzer.normalize(raw_event)
-    # print("normalized_event ==>",normalized_event)
-    
-    if normalized_event is None:
-        return
+    if not ack_ids:
+        return ack_ids
 
-    payload = EventSerializer.to_redis(normalized_event)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        for fields in payloads:
+            pipe.xadd(NORMALIZED_STREAM, fields)
+        pipe.xack(STREAM, GROUP, *ack_ids)
+        await pipe.execute()
 
-    await redis_client.xadd(name="normalized:events",fields={"payload":payload})
-    
-    
+    return ack_ids
 
-    # await redis_client.xadd("sentinel:logs:normalized", {"payload": payload})
 
-  
+def sweep_blobs():
+    try:
+        print(f"Removed {raw_payloads.blobs.sweep()} expired raw payload blobs")
+    except Exception as e:
+        print("Raw payload blob sweep failed:", e)
 
-    
 
+async def consume(consumer: str = CONSUMER):
+    await ensure_topology(redis_client)
+    reclaimer = PendingReclaimer(redis_client, STREAM, GROUP, consumer)
+    last_stats = time.monotonic()
+    sweep = None
+    last_sweep = 0.0
 
-async def consume():
     while running:
         try:
+            if time.monotonic() - last_stats >= STATS_INTERVAL_S:
+                print("Timestamp fast-path stats:", normailzer.timestamps.stats())
+                last_stats = time.monotonic()
+
+            # expire raw payload blobs along with the table TTL, off the event loop
+            if raw_payloads.mode == "blob" and (sweep is None or sweep.done()):
+                if time.monotonic() - last_sweep >= BLOB_SWEEP_INTERVAL_S:
+                    sweep = asyncio.create_task(asyncio.to_thread(sweep_blobs))
+                    last_sweep = time.monotonic()
+
+            if reclaimer.due():
+                entries = await reclaimer.reclaim()
+                if entries:
+                    await process_batch(entries)
+
             messages = await redis_client.xreadgroup(
                 groupname=GROUP,
-                consumername=CONSUMER,
+                consumername=consumer,
                 streams={STREAM: ">"},
-                count=100,          # batch size
-                block=5000          # wait 5s
+                count=BATCH_SIZE,
+                block=BLOCK_MS
             )
 
             if not messages:
                 continue
 
             for _, entries in messages:
-                for msg_id, data in entries:
-                    try:
-                        await process_log(data)
-                        await redis_client.xack(STREAM, GROUP, msg_id)
-                    except Exception as e:
-                        # DO NOT ACK on failure
-                        print("Error processing", msg_id, e)
+                await process_batch(entries)
 
         except Exception as e:
             print("Consumer error:", e)
@@ -97,34 +157,3 @@ print("CONSUMER")
 if __name__ == "__main__":  
     print("CONSUMER STARTED")
     asyncio.run(consume())
-
-
-
-
-
-
-
-
-
-
-
-
-# 6️⃣ Handle stuck messages (advanced but important)
-
-# If a worker crashes, messages get stuck in PEL.
-
-# Use XPENDING + XCLAIM (periodically):
-
-# pending = await redis_client.xpending_range(
-#     STREAM, GROUP, min="-", max="+", count=10
-# )
-
-# for msg in pending:
-#     msg_id = msg["message_id"]
-#     await redis_client.xclaim(
-#         STREAM,
-#         GROUP,
-#         CONSUMER,
-#         min_idle_time=60000,  # 60s
-#         message_ids=[msg_id]
-#     )
\ No newline at end of file
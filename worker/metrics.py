@@ -0,0 +1,57 @@
+import time
+from collections import Counter
+
+
+class Metrics:
+    """
+    Minimal in-process metrics for the worker loops: counters, gauges and
+    summary statistics (count/sum/min/max/last). A snapshot is printed and
+    mirrored into a Redis hash (sentinel:metrics:<name>) so it can be read
+    without attaching to the process.
+    """
+
+    def __init__(self, name: str, report_interval_s: float = 60):
+        self.name = name
+        self.report_interval_s = report_interval_s
+        self.counters = Counter()
+        self.gauges = {}
+        self.summaries = {}
+        self.last_report = time.monotonic()
+
+    def incr(self, key: str, value: int = 1):
+        self.counters[key] += value
+
+    def gauge(self, key: str, value):
+        self.gauges[key] = value
+
+    def observe(self, key: str, value: float):
+        summary = self.summaries.get(key)
+        if summary is None:
+            self.summaries[key] = {"count": 1, "sum": value, "min": value, "max": value, "last": value}
+            return
+        summary["count"] += 1
+        summary["sum"] += value
+        summary["last"] = value
+        if value < summary["min"]:
+            summary["min"] = value
+        if value > summary["max"]:
+            summary["max"] = value
+
+    def snapshot(self) -> dict:
+        flat = dict(self.counters)
+        flat.update(self.gauges)
+        for key, summary in self.summaries.items():
+            for stat, value in summary.items():
+                flat[f"{key}.{stat}"] = value
+            flat[f"{key}.avg"] = summary["sum"] / summary["count"]
+        return flat
+
+    def due(self) -> bool:
+        return time.monotonic() - self.last_report >= self.report_interval_s
+
+    async def report(self, redis=None):
+        self.last_report = time.monotonic()
+        snapshot = self.snapshot()
+        print(f"[metrics:{self.name}]", snapshot)
+        if redis is not None and snapshot:
+            await redis.hset(f"sentinel:metrics:{self.name}", mapping=snapshot)
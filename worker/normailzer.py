@@ -1,119 +1,215 @@
-from uuid import uuid4
 import json
-from dateutil.parser import parse
+from dataclasses import dataclass, field
 
+from worker.timestamps import TimestampParser
+from termtrix_common.termtrix_common.events import NormalizedEvent, event_id_for
 
 
-class SentinelNormlizer:
-    
-    async def normalize(self, e):
-        sentinel = e.get("sentinel")
-        print("EVENT",sentinel)
-        if sentinel == "application":
-            return await self._normalize_internal(e)
-        elif sentinel == "nginx":
-            return await self._normalize_nginx(e)
-        elif sentinel == "suricata":
-            return await self._normalize_suricata(e)
-        else:
-            return await self._normalize_internal(e)
-
-
-    async def _normalize_internal(self, e):
-        # print("internal ==>",e)
-        event = e.get("event", {})
-        return {
-            "event_id": uuid4(),
-            "ts": parse(event.get("timestamp")),
+# ---------------- FIELD MAPPINGS ----------------
+#
+# Each source is described declaratively: where its timestamp lives, which
+# output fields are constants and which are read from a path in the raw
+# Vector envelope. SentinelNormlizer compiles every mapping once into a plain
+# function that builds the NormalizedEvent in a single constructor call.
+#
+# The raw payload is not part of the normalized event: the consumer carries
+# the original stream payload next to it untouched (see EventSerializer).
+
+
+@dataclass(frozen=True)
+class Field:
+    path: tuple                 # keys into the raw envelope, e.g. ("event", "flow", "state")
+    default: object = None
+    cast: str | None = None     # name of a helper in CASTS
+
+
+@dataclass(frozen=True)
+class SourceMapping:
+    source: str
+    timestamp: tuple
+    constants: dict
+    fields: dict                # output field -> Field
+    drop_if: dict = field(default_factory=dict)   # path -> value that filters the event out
+
+
+def _upper(value):
+    return value.upper() if value is not None else None
+
+
+CASTS = {
+    "int": int,
+    "upper": _upper,
+}
+
+
+MAPPINGS = {
+    "application": SourceMapping(
+        source="application",
+        timestamp=("event", "timestamp"),
+        constants={
             "log_origin": "application",
             "source": "sentinel",
-            "level": event.get("level", "INFO").upper(),
             "service": "sentinel-api",
-            "message": event.get("event"),
+            "event_type": "application",
             "src_ip": None,
             "dest_ip": None,
             "http_status": None,
             "user_agent": None,
-            "event_type": "application",
-            "raw_json": json.dumps(e),
-        }
-
-    async def _normalize_nginx(self, e):
-        # print(e,"EVENTTTTTTTT")
-        http = e.get("event")
-        # message = http.get("event")
-        # json.loads()
-        # print(http,"HTTP",type(http))
-        # print(http.get("remote_addr"),"+++++++++++++")
-        return {
-            "event_id": uuid4(),
-            "ts":parse(e.get("timestamp")),
+        },
+        fields={
+            "level": Field(("event", "level"), "INFO", "upper"),
+            "message": Field(("event", "event")),
+        },
+    ),
+    "nginx": SourceMapping(
+        source="nginx",
+        timestamp=("timestamp",),
+        constants={
             "log_origin": "network",
             "source": "nginx",
             "level": "INFO",
             "service": "nginx",
-            "message": http.get("request"),
-            "src_ip": http.get("remote_addr"),
             "dest_ip": None,
             "event_type": "http",
-            "http_status": int(http.get("status", 0)),
-            "user_agent": http.get("http_user_agent"),
-            "raw_json": json.dumps(http),
-        }
-
-    async def _normalize_suricata(self, e):
-        flow = e.get("event", {}).get("flow", {})   
-        evt = e.get("event", {})
-
-        if evt.get("event_type") == "stats":
-            print("stats ==>")
-            return None
-
-        return {
-            "event_id": uuid4(),
-            "ts": parse(evt["timestamp"]),
+        },
+        fields={
+            "message": Field(("event", "request")),
+            "src_ip": Field(("event", "remote_addr")),
+            "http_status": Field(("event", "status"), 0, "int"),
+            "user_agent": Field(("event", "http_user_agent")),
+        },
+    ),
+    "suricata": SourceMapping(
+        source="suricata",
+        timestamp=("event", "timestamp"),
+        constants={
             "log_origin": "security",
             "source": "suricata",
             "level": "INFO",
             "service": "suricata",
-            "message": "network_flow",
-
             "event_type": "flow",
-            "flow_id": evt.get("flow_id",None),
-
-            "src_ip": evt.get("src_ip",None),
-            "src_port": evt.get("src_port",None),
-            "dest_ip": evt.get("dest_ip",None),
-            "dest_port": evt.get("dest_port",None),
-            "protocol": evt.get("proto",None),
-
-            "bytes_toserver": flow.get("bytes_toserver",None),
-            "bytes_toclient": flow.get("bytes_toclient",None),
-            "pkts_toserver": flow.get("pkts_toserver",None),
-            "pkts_toclient": flow.get("pkts_toclient",None),
-            "flow_state": flow.get("state",None),
-            "flow_reason": flow.get("reason",None),
-            "flow_age": flow.get("age",None),
-            "alerted": flow.get("alerted",False),
-
-            "raw_json": json.dumps(e),
-        }
-    
-
+        },
+        fields={
+            "message": Field(("event", "alert", "signature"), "network_flow"),
+            "flow_id": Field(("event", "flow_id")),
+            "src_ip": Field(("event", "src_ip")),
+            "src_port": Field(("event", "src_port")),
+            "dest_ip": Field(("event", "dest_ip")),
+            "dest_port": Field(("event", "dest_port")),
+            "protocol": Field(("event", "proto")),
+            "bytes_toserver": Field(("event", "flow", "bytes_toserver")),
+            "bytes_toclient": Field(("event", "flow", "bytes_toclient")),
+            "pkts_toserver": Field(("event", "flow", "pkts_toserver")),
+            "pkts_toclient": Field(("event", "flow", "pkts_toclient")),
+            "flow_state": Field(("event", "flow", "state")),
+            "flow_reason": Field(("event", "flow", "reason")),
+            "flow_age": Field(("event", "flow", "age")),
+            "alerted": Field(("event", "flow", "alerted"), False),
+        },
+        drop_if={("event", "event_type"): "stats"},
+    ),
+}
+
+DEFAULT_SOURCE = "application"
+
+
+def canonical_payload(e) -> str:
+    """
+    Stable text of an already decoded envelope, for callers without the raw payload
+    """
+    return json.dumps(e, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def compile_mapping(mapping: SourceMapping, parse_ts):
+    """
+    Generate a specialized synchronous normalizer for one source.
+
+    Every nested dict on a field path is looked up once into a local, and the
+    output is a single keyword constructor call, so the per-event cost is a handful of
+    dict.get calls with no interpretation of the mapping at run time.
+    """
+    lines = [f"def normalize_{mapping.source}(e, raw):"]
+    parents = {(): "e"}
+
+    def ref(path):
+        if path not in parents:
+            parent = ref(path[:-1])
+            var = f"_p{len(parents)}"
+            lines.append(f"    {var} = {parent}.get({path[-1]!r}) or EMPTY")
+            parents[path] = var
+        return parents[path]
+
+    def get(path, default=None):
+        return f"{ref(path[:-1])}.get({path[-1]!r}, {default!r})"
+
+    for path, value in mapping.drop_if.items():
+        lines.append(f"    if {get(path)} == {value!r}:")
+        lines.append("        return None")
+
+    lines.append(f"    ts = parse_ts({get(mapping.timestamp)}, {mapping.source!r})")
+    items = [
+        f"event_id=event_id_for({mapping.source!r}, ts, raw)",
+        "ts=ts",
+    ]
+    items += [f"{name}={value!r}" for name, value in mapping.constants.items()]
+    for name, spec in mapping.fields.items():
+        expr = get(spec.path, spec.default)
+        if spec.cast:
+            expr = f"CASTS[{spec.cast!r}]({expr})"
+        items.append(f"{name}={expr}")
+
+    lines.append("    return NormalizedEvent(")
+    lines += [f"        {item}," for item in items]
+    lines.append("    )")
+
+    namespace = {
+        "EMPTY": {},
+        "CASTS": CASTS,
+        "event_id_for": event_id_for,
+        "NormalizedEvent": NormalizedEvent,
+        "parse_ts": parse_ts,
+    }
+    exec("\n".join(lines), namespace)
+    return namespace[f"normalize_{mapping.source}"]
 
 
+class SentinelNormlizer:
 
+    def __init__(self, mappings: dict = MAPPINGS):
+        self.timestamps = TimestampParser()
+        self.normalizers = {
+            sentinel: compile_mapping(mapping, self.timestamps.parse)
+            for sentinel, mapping in mappings.items()
+        }
+        self.default = self.normalizers[DEFAULT_SOURCE]
+
+    def normalize(self, e, raw=None):
+        """
+        Raw Vector envelope -> NormalizedEvent, or None when filtered out.
+        raw is the payload the envelope was decoded from; the event ID is
+        derived from it (a canonical dump of e is hashed when it is missing).
+        """
+        if raw is None:
+            raw = canonical_payload(e)
+        return self.normalizers.get(e.get("sentinel"), self.default)(e, raw)
+
+    def normalize_batch(self, events: list, raws: list | None = None) -> list:
+        """
+        Normalize a list of raw events in one call. The result is aligned with
+        the input: a NormalizedEvent, None (filtered), or the exception raised
+        for that event.
+        """
+        normalizers = self.normalizers
+        default = self.default
+        if raws is None:
+            raws = [None] * len(events)
+        results = []
+        for e, raw in zip(events, raws):
+            try:
+                if raw is None:
+                    raw = canonical_payload(e)
+                results.append(normalizers.get(e.get("sentinel"), default)(e, raw))
+            except Exception as error:
+                results.append(error)
+        return results
 
-# {
-#   "event_id": "...",
-#   "ts": "...",
-#   "log_origin": "network",
-#   "source": "nginx",
-#   "level": "INFO",
-#   "service": "sentinel-api",
-#   "message": "GET /",
-#   "src_ip": "192.168.1.62",
-#   "http_status": 200,
-#   "user_agent": "...",
-#   "raw_json": "{...}"
-# }
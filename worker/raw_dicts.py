@@ -0,0 +1,58 @@
+import argparse
+import asyncio
+import json
+from collections import defaultdict
+
+from worker.normailzer import SentinelNormlizer
+from termtrix_common.termtrix_common.raw_payloads import RAW_DICT_DIR, train_dictionary
+from termtrix_common.termtrix_common.redis_client import redis_client
+from termtrix_common.termtrix_common.topology import RAW_STREAM
+
+
+SAMPLE_ENTRIES = 20000
+MIN_SAMPLES = 1000   # fewer samples than this train a dictionary that hurts more than it helps
+PAGE_SIZE = 1000
+
+
+async def collect_samples(limit: int) -> dict:
+    """
+    The newest raw payloads of the ingest stream, grouped by the source
+    their normalized events get
+    """
+    normalizer = SentinelNormlizer()
+    samples = defaultdict(list)
+    seen = 0
+    end = "+"
+    while seen < limit:
+        entries = await redis_client.xrevrange(RAW_STREAM, max=end, count=PAGE_SIZE)
+        if not entries:
+            break
+        for msg_id, fields in entries:
+            raw = fields.get("payload")
+            try:
+                event = normalizer.normalize(json.loads(raw), raw)
+            except Exception:
+                continue
+            if event is not None:
+                samples[event.source].append(raw)
+        seen += len(entries)
+        end = f"({entries[-1][0]}"
+    return samples
+
+
+async def main(limit: int, dict_dir: str):
+    samples = await collect_samples(limit)
+    for source, payloads in samples.items():
+        if len(payloads) < MIN_SAMPLES:
+            print(f"{source}: only {len(payloads)} samples, skipped")
+            continue
+        path = train_dictionary(source, payloads, dict_dir)
+        print(f"{source}: trained {path.name} from {len(payloads)} samples")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train per-source zstd dictionaries for raw payloads")
+    parser.add_argument("--samples", type=int, default=SAMPLE_ENTRIES, help="stream entries to sample")
+    parser.add_argument("--dict-dir", default=RAW_DICT_DIR)
+    args = parser.parse_args()
+    asyncio.run(main(args.samples, args.dict_dir))
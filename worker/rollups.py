@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta, timezone
+
+from worker.columnar import to_ipv6
+from worker.schema import SENTINEL_LOGS_MINUTE
+
+
+SUM_FIELDS = (
+    "events",
+    "status_2xx",
+    "status_3xx",
+    "status_4xx",
+    "status_5xx",
+    "status_401_403",
+    "status_404",
+    "bytes_toserver",
+    "bytes_toclient",
+)
+UNIQ_FIELDS = ("distinct_paths", "distinct_dest_ports")
+ROLLUP_FIELDS = SUM_FIELDS + UNIQ_FIELDS
+
+# Merged per-minute columns, shared by every query below
+ROLLUP_COLUMNS = ",\n".join(
+    [f"sum({name}) AS {name}" for name in SUM_FIELDS]
+    + [f"uniqMerge({name}) AS {name}" for name in UNIQ_FIELDS]
+)
+
+
+def _since(window: timedelta, until: datetime | None = None) -> tuple[datetime, datetime]:
+    until = until or datetime.now(timezone.utc)
+    return until - window, until
+
+
+def _rows(result) -> list:
+    return [dict(zip(result.column_names, row)) for row in result.result_rows]
+
+
+class RollupQueries:
+    """
+    Reads the per-minute sentinel_logs_minute rollups. Long-window checks and
+    trend panels scan a few rows per (source, src_ip, minute) instead of the
+    raw events.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def window_totals(self, source: str, src_ip: str, window: timedelta, until: datetime | None = None) -> dict:
+        """
+        Totals for one source/IP over a lookback window, e.g. failed logins
+        (status_401_403) or distinct destination ports in the last 24h.
+        """
+        start, end = _since(window, until)
+        result = self.client.query(
+            f"""
+            SELECT {ROLLUP_COLUMNS}
+            FROM {SENTINEL_LOGS_MINUTE}
+            WHERE source = {{source:String}}
+              AND src_ip = {{src_ip:IPv6}}
+              AND minute >= toStartOfMinute({{start:DateTime}})
+              AND minute < {{end:DateTime}}
+            """,
+            parameters={"source": source, "src_ip": str(to_ipv6(src_ip)), "start": start, "end": end},
+        )
+        rows = _rows(result)
+        return rows[0] if rows else {}
+
+    def ip_timeline(self, src_ip: str, window: timedelta, source: str | None = None, step_minutes: int = 1) -> list:
+        """
+        Activity of one IP bucketed by step_minutes, for trend panels
+        """
+        start, end = _since(window)
+        parameters = {"src_ip": str(to_ipv6(src_ip)), "start": start, "end": end, "step": step_minutes}
+        source_filter = ""
+        if source:
+            source_filter = "AND source = {source:String}"
+            parameters["source"] = source
+
+        result = self.client.query(
+            f"""
+            SELECT
+                toStartOfInterval(minute, toIntervalMinute({{step:UInt32}})) AS bucket,
+                source,
+                {ROLLUP_COLUMNS}
+            FROM {SENTINEL_LOGS_MINUTE}
+            WHERE src_ip = {{src_ip:IPv6}}
+              AND minute >= toStartOfMinute({{start:DateTime}})
+              AND minute < {{end:DateTime}}
+              {source_filter}
+            GROUP BY bucket, source
+            ORDER BY bucket, source
+            """,
+            parameters=parameters,
+        )
+        return _rows(result)
+
+    def top_sources(self, source: str, window: timedelta, order_by: str = "events", limit: int = 20) -> list:
+        """
+        Top src_ips of a source over a window, ranked by one rollup column
+        (events, status_404, distinct_dest_ports, ...)
+        """
+        if order_by not in ROLLUP_FIELDS:
+            raise ValueError(f"order_by must be one of {', '.join(ROLLUP_FIELDS)}")
+
+        start, end = _since(window)
+        result = self.client.query(
+            f"""
+            SELECT src_ip, {ROLLUP_COLUMNS}
+            FROM {SENTINEL_LOGS_MINUTE}
+            WHERE source = {{source:String}}
+              AND minute >= toStartOfMinute({{start:DateTime}})
+              AND minute < {{end:DateTime}}
+            GROUP BY src_ip
+            ORDER BY {order_by} DESC
+            LIMIT {{limit:UInt32}}
+            """,
+            parameters={"source": source, "start": start, "end": end, "limit": limit},
+        )
+        return _rows(result)
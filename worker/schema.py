@@ -0,0 +1,390 @@
+import os
+import socket
+import time
+
+
+# ---------------- CONFIG ----------------
+
+SENTINEL_LOGS = "sentinel_logs"
+SENTINEL_LOGS_MINUTE = "sentinel_logs_minute"
+SENTINEL_LOGS_MINUTE_MV = "sentinel_logs_minute_mv"
+MIGRATIONS_TABLE = "sentinel_schema_migrations"
+# Held while migrations run. It is a table, not a session lock, so a
+# migration that crashes leaves it behind: once no writer is migrating,
+# DROP TABLE sentinel_schema_lock (its COMMENT names the holder).
+MIGRATIONS_LOCK = "sentinel_schema_lock"
+LEGACY_TABLE = "sentinel_logs_legacy"
+
+TTL_DAYS = int(os.getenv("SENTINEL_LOGS_TTL_DAYS", 90))
+ROLLUP_TTL_DAYS = int(os.getenv("SENTINEL_ROLLUP_TTL_DAYS", 400))
+DEDUP_WINDOW = 1000   # recent insert blocks remembered per table
+MIGRATION_LOCK_WAIT_S = int(os.getenv("MIGRATION_LOCK_WAIT_S", 1800))
+ROLLUP_BACKFILL_ATTEMPTS = 5   # tries at a view creation no insert raced with
+
+
+# ---------------- SCHEMA ----------------
+#
+# Column order matches STORAGE_COLUMNS in termtrix_common.events.
+# IPs are IPv6 (IPv4 stored IPv4-mapped) so one sort key covers both;
+# strings and counters are non-nullable with defaults to keep them out of
+# the sort key's null map and make codecs effective.
+
+SENTINEL_LOGS_DDL = f"""
+CREATE TABLE IF NOT EXISTS {SENTINEL_LOGS}
+(
+    event_id        UUID,
+    ts              DateTime64(6, 'UTC') CODEC(Delta, ZSTD(1)),
+    log_origin      LowCardinality(String),
+    source          LowCardinality(String),
+    level           LowCardinality(String),
+    service         LowCardinality(String),
+    event_type      LowCardinality(String),
+    message         String CODEC(ZSTD(3)),
+
+    src_ip          IPv6,
+    dest_ip         IPv6,
+    src_port        UInt16 DEFAULT 0,
+    dest_port       UInt16 DEFAULT 0,
+    protocol        LowCardinality(String),
+
+    http_status     UInt16 DEFAULT 0,
+    user_agent      String CODEC(ZSTD(3)),
+
+    flow_id         UInt64 DEFAULT 0 CODEC(ZSTD(1)),
+    flow_state      LowCardinality(String),
+    flow_reason     LowCardinality(String),
+    flow_age        UInt64 DEFAULT 0 CODEC(T64, ZSTD(1)),
+    bytes_toserver  UInt64 DEFAULT 0 CODEC(T64, ZSTD(1)),
+    bytes_toclient  UInt64 DEFAULT 0 CODEC(T64, ZSTD(1)),
+    pkts_toserver   UInt64 DEFAULT 0 CODEC(T64, ZSTD(1)),
+    pkts_toclient   UInt64 DEFAULT 0 CODEC(T64, ZSTD(1)),
+    alerted         Bool DEFAULT false,
+
+    raw_json        String CODEC(ZSTD(6)),
+
+    INDEX idx_message_ngram    message    TYPE ngrambf_v1(3, 65536, 2, 0) GRANULARITY 4,
+    INDEX idx_message_token    message    TYPE tokenbf_v1(32768, 3, 0)    GRANULARITY 4,
+    INDEX idx_user_agent_ngram user_agent TYPE ngrambf_v1(3, 32768, 2, 0) GRANULARITY 4,
+    INDEX idx_user_agent_token user_agent TYPE tokenbf_v1(16384, 3, 0)    GRANULARITY 4,
+    INDEX idx_dest_ip          dest_ip    TYPE bloom_filter(0.01)         GRANULARITY 4
+)
+ENGINE = MergeTree
+PARTITION BY toDate(ts)
+ORDER BY (source, src_ip, ts)
+TTL toDateTime(ts) + INTERVAL {TTL_DAYS} DAY
+SETTINGS index_granularity = 8192
+"""
+
+
+# Per-minute, per-(source, src_ip) rollups kept up to date by a materialized
+# view. Counters are plain sums; distinct paths / destination ports are uniq
+# states merged at query time (see worker/rollups.py).
+
+SENTINEL_LOGS_MINUTE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {SENTINEL_LOGS_MINUTE}
+(
+    minute              DateTime('UTC'),
+    source              LowCardinality(String),
+    src_ip              IPv6,
+    events              SimpleAggregateFunction(sum, UInt64),
+    status_2xx          SimpleAggregateFunction(sum, UInt64),
+    status_3xx          SimpleAggregateFunction(sum, UInt64),
+    status_4xx          SimpleAggregateFunction(sum, UInt64),
+    status_5xx          SimpleAggregateFunction(sum, UInt64),
+    status_401_403      SimpleAggregateFunction(sum, UInt64),
+    status_404          SimpleAggregateFunction(sum, UInt64),
+    bytes_toserver      SimpleAggregateFunction(sum, UInt64),
+    bytes_toclient      SimpleAggregateFunction(sum, UInt64),
+    distinct_paths      AggregateFunction(uniq, String),
+    distinct_dest_ports AggregateFunction(uniq, UInt16)
+)
+ENGINE = AggregatingMergeTree
+PARTITION BY toYYYYMM(minute)
+ORDER BY (source, src_ip, minute)
+TTL minute + INTERVAL {ROLLUP_TTL_DAYS} DAY
+"""
+
+# nginx message is the request line: "GET /path?query HTTP/1.1"
+ROLLUP_SELECT = f"""
+SELECT
+    toStartOfMinute(ts) AS minute,
+    source,
+    src_ip,
+    count() AS events,
+    countIf(http_status BETWEEN 200 AND 299) AS status_2xx,
+    countIf(http_status BETWEEN 300 AND 399) AS status_3xx,
+    countIf(http_status BETWEEN 400 AND 499) AS status_4xx,
+    countIf(http_status BETWEEN 500 AND 599) AS status_5xx,
+    countIf(http_status IN (401, 403)) AS status_401_403,
+    countIf(http_status = 404) AS status_404,
+    sum(bytes_toserver) AS bytes_toserver,
+    sum(bytes_toclient) AS bytes_toclient,
+    uniqStateIf(
+        splitByChar('?', splitByChar(' ', message)[2])[1],
+        source = 'nginx' AND message != ''
+    ) AS distinct_paths,
+    uniqStateIf(dest_port, dest_port != 0) AS distinct_dest_ports
+FROM {SENTINEL_LOGS}
+"""
+
+
+# ---------------- MIGRATIONS ----------------
+
+def adopt_legacy_table(manager):
+    """
+    sentinel_logs used to be created by hand with a narrower, untyped layout.
+    Move such a table aside, create the managed one and copy its rows over
+    (INSERT SELECT casts each column, NULLs become column defaults).
+    """
+    columns = manager.table_columns(SENTINEL_LOGS)
+    legacy = bool(columns) and columns.get("src_ip") != "IPv6"
+
+    if legacy:
+        print(f"Moving unmanaged {SENTINEL_LOGS} aside as {LEGACY_TABLE}")
+        manager.command(f"RENAME TABLE {SENTINEL_LOGS} TO {LEGACY_TABLE}")
+
+    manager.command(SENTINEL_LOGS_DDL)
+
+    if legacy:
+        shared = [name for name in manager.table_columns(SENTINEL_LOGS) if name in columns]
+        names = ", ".join(shared)
+        manager.command(
+            f"INSERT INTO {SENTINEL_LOGS} ({names}) SELECT {names} FROM {LEGACY_TABLE}",
+            settings={"insert_null_as_default": 1},
+        )
+
+
+def active_parts(manager) -> list:
+    result = manager.client.query(
+        "SELECT name FROM system.parts "
+        "WHERE database = currentDatabase() AND table = {table:String} AND active ORDER BY name",
+        parameters={"table": SENTINEL_LOGS},
+    )
+    return [name for (name,) in result.result_rows]
+
+
+def inserts_running_for(manager, seconds: float) -> int:
+    """
+    INSERTs into sentinel_logs that have been running at least this long
+    """
+    return int(manager.client.command(
+        "SELECT count() FROM system.processes WHERE query_kind = 'Insert' "
+        "AND match(query, {pattern:String}) AND elapsed >= {seconds:Float64}",
+        parameters={"pattern": f"(?i)INSERT\\s+INTO\\s+[`\"]?{SENTINEL_LOGS}[`\"]?[\\s(]", "seconds": seconds},
+    ))
+
+
+def drop_minute_rollups(manager):
+    manager.command(f"DROP VIEW IF EXISTS {SENTINEL_LOGS_MINUTE_MV}")
+    manager.command(f"TRUNCATE TABLE {SENTINEL_LOGS_MINUTE}")
+
+
+def create_minute_rollups(manager):
+    """
+    Create the rollup table and its materialized view, then backfill the
+    rows that were already stored before the view existed.
+
+    The view is created first and the backfill reads the parts listed just
+    before it, with merges stopped so none of them is merged with a newer
+    part. That is exact only if no insert overlapped the view's creation:
+    afterwards the parts are listed again and running inserts checked, and
+    if one raced the view is dropped and the step retried. Writers of this
+    version wait on the migration lock before inserting, so only writers of
+    an older version can race; stop them if the step keeps failing.
+
+    The step only runs under the migration lock while its version is
+    unrecorded, so a view or rollup rows found here come from an
+    interrupted earlier run: they are dropped and the rollups rebuilt from
+    scratch, which makes a retry exact. A crash mid-step can leave merges
+    on sentinel_logs stopped until the step is retried (or SYSTEM START
+    MERGES is run by hand).
+    """
+    manager.command(SENTINEL_LOGS_MINUTE_DDL)
+    if manager.table_exists(SENTINEL_LOGS_MINUTE_MV) or int(
+        manager.client.command(f"SELECT count() FROM {SENTINEL_LOGS_MINUTE}")
+    ):
+        print(f"Resetting {SENTINEL_LOGS_MINUTE} left by an interrupted rollup migration")
+        drop_minute_rollups(manager)
+
+    manager.command(f"SYSTEM STOP MERGES {SENTINEL_LOGS}")
+    try:
+        for attempt in range(ROLLUP_BACKFILL_ATTEMPTS):
+            parts = active_parts(manager)
+            manager.command(
+                f"CREATE MATERIALIZED VIEW {SENTINEL_LOGS_MINUTE_MV} "
+                f"TO {SENTINEL_LOGS_MINUTE} AS {ROLLUP_SELECT} GROUP BY minute, source, src_ip"
+            )
+            created = time.monotonic()
+
+            # an insert that started before the view is not in it: it must either
+            # be in `parts` already or be found here (1s slack for clock and latency)
+            raced = active_parts(manager) != parts or inserts_running_for(
+                manager, max(0.0, time.monotonic() - created - 1)
+            )
+            if not raced:
+                break
+            print(f"An insert raced the rollup view creation (attempt {attempt + 1}), retrying")
+            drop_minute_rollups(manager)
+            time.sleep(2 ** attempt)
+        else:
+            raise RuntimeError(
+                f"inserts into {SENTINEL_LOGS} kept racing the rollup view creation; "
+                "stop writers of older versions and retry"
+            )
+
+        if parts:
+            manager.client.command(
+                f"INSERT INTO {SENTINEL_LOGS_MINUTE} {ROLLUP_SELECT} "
+                "WHERE _part IN {parts:Array(String)} GROUP BY minute, source, src_ip",
+                parameters={"parts": parts},
+            )
+    finally:
+        manager.command(f"SYSTEM START MERGES {SENTINEL_LOGS}")
+
+
+def enable_insert_deduplication(manager):
+    """
+    Plain (non-replicated) MergeTree tables ignore insert deduplication
+    tokens unless they keep a window of recent block hashes. Replicated and
+    shared engines deduplicate already.
+    """
+    for table in (SENTINEL_LOGS, SENTINEL_LOGS_MINUTE):
+        engine = manager.client.command(
+            "SELECT engine FROM system.tables WHERE database = currentDatabase() AND name = {table:String}",
+            parameters={"table": table},
+        )
+        if engine in ("MergeTree", "AggregatingMergeTree"):
+            manager.command(
+                f"ALTER TABLE {table} MODIFY SETTING non_replicated_deduplication_window = {DEDUP_WINDOW}"
+            )
+
+
+# Compressed raw payloads (see termtrix_common.raw_payloads): the zstd frame
+# is already compressed, so the column skips ClickHouse's own codec.
+ADD_RAW_PAYLOAD_COLUMNS = f"""
+ALTER TABLE {SENTINEL_LOGS}
+    ADD COLUMN IF NOT EXISTS raw_zstd String CODEC(NONE) AFTER raw_json,
+    ADD COLUMN IF NOT EXISTS raw_ref  String CODEC(ZSTD(1)) AFTER raw_zstd
+"""
+
+
+# (version, description, steps): a step is a SQL string or a callable(manager)
+MIGRATIONS = [
+    (1, "typed sentinel_logs with codecs, daily partitions, TTL and skip indexes", [adopt_legacy_table]),
+    (2, "per-minute per-src_ip rollups via materialized view", [create_minute_rollups]),
+    (3, "keep recent insert block hashes for token deduplication", [enable_insert_deduplication]),
+    (4, "zstd-compressed and blob-store raw payload columns", [ADD_RAW_PAYLOAD_COLUMNS]),
+]
+
+
+class SchemaManager:
+    """
+    Applies MIGRATIONS in order and records each applied version in
+    sentinel_schema_migrations, so every writer can call migrate() on start.
+
+    Writers that start together take turns: migrating needs the
+    sentinel_schema_lock table, which only one of them can create, and
+    the version is read again once the lock is held. The lock does not
+    expire: after a crashed migration it has to be dropped by hand.
+    """
+
+    def __init__(self, client, migrations: list = MIGRATIONS):
+        self.client = client
+        self.migrations = migrations
+
+    def command(self, sql: str, settings: dict | None = None):
+        return self.client.command(sql, settings=settings)
+
+    def table_columns(self, table: str) -> dict:
+        result = self.client.query(
+            "SELECT name, type FROM system.columns "
+            "WHERE database = currentDatabase() AND table = {table:String} ORDER BY position",
+            parameters={"table": table},
+        )
+        return {name: type_ for name, type_ in result.result_rows}
+
+    def table_exists(self, table: str) -> bool:
+        return bool(int(self.client.command(f"EXISTS TABLE {table}")))
+
+    def current_version(self) -> int:
+        self.command(f"""
+            CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE}
+            (
+                version     UInt32,
+                description String,
+                applied_at  DateTime DEFAULT now()
+            )
+            ENGINE = MergeTree
+            ORDER BY version
+        """)
+        return int(self.client.command(f"SELECT max(version) FROM {MIGRATIONS_TABLE}") or 0)
+
+    def lock(self, wait_s: int = MIGRATION_LOCK_WAIT_S):
+        """
+        Create the lock table, waiting while another process holds it. A
+        lock left behind by a crashed migration has to be dropped by hand.
+        """
+        holder = f"{socket.gethostname()}:{os.getpid()}"
+        deadline = time.monotonic() + wait_s
+        while True:
+            try:
+                self.command(f"CREATE TABLE {MIGRATIONS_LOCK} (holder String) ENGINE = Memory COMMENT '{holder}'")
+                return
+            except Exception as e:
+                if "TABLE_ALREADY_EXISTS" not in str(e):
+                    raise
+            if time.monotonic() > deadline:
+                raise RuntimeError(
+                    f"schema migration lock {MIGRATIONS_LOCK} still held after {wait_s}s; "
+                    "drop that table if no migration is running"
+                )
+            print(f"Waiting for another process to finish schema migrations (lock held by {self.lock_holder()})")
+            time.sleep(2)
+
+    def lock_holder(self) -> str:
+        return self.client.command(
+            "SELECT comment FROM system.tables WHERE database = currentDatabase() AND name = {table:String}",
+            parameters={"table": MIGRATIONS_LOCK},
+        ) or "unknown"
+
+    def unlock(self):
+        self.command(f"DROP TABLE IF EXISTS {MIGRATIONS_LOCK}")
+
+    def migrate(self) -> list:
+        """
+        Apply every migration newer than the recorded version, return their versions
+        """
+        latest = max((version for version, _, _ in self.migrations), default=0)
+        if self.current_version() >= latest:
+            return []
+
+        self.lock()
+        try:
+            return self.apply(self.current_version())
+        finally:
+            self.unlock()
+
+    def apply(self, current: int) -> list:
+        applied = []
+        for version, description, steps in self.migrations:
+            if version <= current:
+                continue
+            print(f"Applying schema migration {version}: {description}")
+            for step in steps:
+                if callable(step):
+                    step(self)
+                else:
+                    self.command(step)
+            self.client.insert(
+                MIGRATIONS_TABLE,
+                [(version, description)],
+                column_names=["version", "description"],
+            )
+            applied.append(version)
+        return applied
+
+
+if __name__ == "__main__":
+    from worker.storage import connection
+
+    print("Applied migrations:", SchemaManager(connection.client).migrate() or "none")
@@ -1,36 +1,53 @@
-import json
-from uuid import UUID
-from datetime import datetime
-from dateutil.parser import isoparse
+import base64
+
+from termtrix_common.termtrix_common.events import NormalizedEvent, decode_event, encode_event
+from termtrix_common.termtrix_common.raw_payloads import RawPayloads
 
 
 class EventSerializer:
+    """
+    Normalized events travel as a payload stream field plus one raw field:
+
+      payload  the encoded NormalizedEvent (without the raw payload)
+      raw      the original ingest payload, passed through byte-for-byte
+      raw_z    or: its zstd frame, base64
+      raw_ref  or: the key of its zstd frame in the local blob store
+
+    so the raw event is never re-encoded or escaped inside another document.
+    """
+
     @staticmethod
-    def to_redis(event: dict) -> str:
+    def to_redis(event: NormalizedEvent):
         """
-        Python objects → JSON string (Redis-safe)
+        NormalizedEvent → JSON (Redis-safe)
         """
-        def convert(value):
-            if isinstance(value, UUID):
-                return str(value)
-            if isinstance(value, datetime):
-                return value.isoformat()
-            return value
-
-        safe = {k: convert(v) for k, v in event.items()}
-        return json.dumps(safe)
+        return encode_event(event)
 
     @staticmethod
-    def from_redis(payload: str) -> dict:
+    def from_redis(payload) -> NormalizedEvent:
         """
-        JSON string → Python objects
+        JSON → NormalizedEvent
         """
-        event = json.loads(payload)
+        return decode_event(payload)
 
-        if "event_id" in event:
-            event["event_id"] = UUID(event["event_id"])
-
-        if "ts" in event:
-            event["ts"] = isoparse(event["ts"])
+    @staticmethod
+    def to_stream_fields(event: NormalizedEvent, raw: str | None, raw_payloads: RawPayloads | None = None) -> dict:
+        fields = {"payload": EventSerializer.to_redis(event)}
+        if raw_payloads is not None:
+            fields.update(raw_payloads.stream_fields(event.source, raw))
+        elif raw is not None:
+            fields["raw"] = raw
+        return fields
 
+    @staticmethod
+    def from_stream_fields(fields: dict) -> NormalizedEvent:
+        """
+        Stream fields → NormalizedEvent with the raw payload in whichever
+        form it travelled (raw_json, raw_zstd or raw_ref)
+        """
+        event = decode_event(fields["payload"])
+        event.raw_json = fields.get("raw")
+        if "raw_z" in fields:
+            event.raw_zstd = base64.b64decode(fields["raw_z"])
+        event.raw_ref = fields.get("raw_ref")
         return event
@@ -0,0 +1,309 @@
+import os
+import re
+import socket
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from pathlib import Path
+
+from worker.columnar import NUMERIC_TYPECODES, ColumnBatch
+from worker.schema import SENTINEL_LOGS, SchemaManager
+from worker.storage import connection
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only the parquet sink needs it
+    pa = None
+    pq = None
+
+
+# ---------------- CONFIG ----------------
+
+SENTINEL_SINK = os.getenv("SENTINEL_SINK", "clickhouse")
+
+PARQUET_DIR = os.getenv("PARQUET_DIR", "./archive")
+PARQUET_ROW_GROUP_ROWS = int(os.getenv("PARQUET_ROW_GROUP_ROWS", 100000))
+PARQUET_ROW_GROUP_BYTES = int(os.getenv("PARQUET_ROW_GROUP_BYTES", 64 * 1024 * 1024))
+PARQUET_ROW_GROUP_S = float(os.getenv("PARQUET_ROW_GROUP_S", 60))
+PARQUET_FILE_BYTES = int(os.getenv("PARQUET_FILE_BYTES", 512 * 1024 * 1024))
+PARQUET_FILE_S = float(os.getenv("PARQUET_FILE_S", 300))
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+
+# ClickHouse errors that rejecting the same block again would repeat: bad
+# values, or columns/types that don't match the table
+CLICKHOUSE_PERMANENT_ERRORS = {
+    6,     # CANNOT_PARSE_TEXT
+    8,     # THERE_IS_NO_COLUMN
+    10,    # NOT_FOUND_COLUMN_IN_BLOCK
+    16,    # NO_SUCH_COLUMN_IN_TABLE
+    20,    # NUMBER_OF_COLUMNS_DOESNT_MATCH
+    27,    # CANNOT_PARSE_INPUT_ASSERTION_FAILED
+    33,    # CANNOT_READ_ALL_DATA
+    41,    # CANNOT_PARSE_DATETIME
+    53,    # TYPE_MISMATCH
+    69,    # ARGUMENT_OUT_OF_BOUND
+    70,    # CANNOT_CONVERT_TYPE
+    72,    # CANNOT_PARSE_NUMBER
+    117,   # INCORRECT_DATA
+}
+
+
+class StorageSink(ABC):
+    """
+    Where the writer puts its column batches. Sinks connect lazily and are
+    only called from the writer's insert thread.
+
+    write() returns True once everything written so far is durable. A sink
+    that buffers (commit_delay_s > 0) returns False until it commits, and the
+    writer holds the stream ACKs of those batches until write() or commit()
+    makes them durable.
+    """
+
+    name = "sink"
+    commit_delay_s = 0.0   # longest a written row may stay non-durable
+
+    def prepare(self):
+        """
+        One-time setup on writer start (schema, directories)
+        """
+
+    def ping(self) -> bool:
+        return True
+
+    def permanent(self, error: Exception) -> bool:
+        """
+        True when writing the same batch again cannot succeed: the data is
+        rejected, rather than the sink being unavailable
+        """
+        return isinstance(error, (ValueError, TypeError))
+
+    @abstractmethod
+    def write(self, batch: ColumnBatch) -> bool:
+        """
+        Store one batch; True when it (and everything before it) is durable
+        """
+
+    def commit(self):
+        """
+        Make everything written so far durable
+        """
+
+    def close(self):
+        self.commit()
+
+
+class ClickHouseSink(StorageSink):
+    """
+    Column-oriented inserts into sentinel_logs. Every insert is durable on
+    return and carries the batch's deduplication token.
+    """
+
+    name = "clickhouse"
+
+    def __init__(self, storage=connection, table: str = SENTINEL_LOGS):
+        self.storage = storage
+        self.table = table
+
+    def prepare(self):
+        SchemaManager(self.storage.client).migrate()
+
+    def ping(self) -> bool:
+        return self.storage.client.ping()
+
+    def permanent(self, error: Exception) -> bool:
+        # server errors carry their code (older clickhouse-connect only in the text)
+        code = getattr(error, "code", None)
+        if code is None:
+            found = re.search(r"\bcode: (\d+)", str(error), re.IGNORECASE)
+            code = found and found.group(1)
+        if code is not None:
+            return int(code) in CLICKHOUSE_PERMANENT_ERRORS
+        # raised while encoding the block, before it reached the server
+        return super().permanent(error) or type(error).__name__ in ("DataError", "ProgrammingError")
+
+    def write(self, batch: ColumnBatch) -> bool:
+        settings = None
+        if batch.dedup_token:
+            # a retried insert of the same block is dropped by ClickHouse, and
+            # so is its rollup block in the materialized view
+            settings = {
+                "insert_deduplicate": 1,
+                "insert_deduplication_token": batch.dedup_token,
+                "deduplicate_blocks_in_dependent_materialized_views": 1,
+            }
+        self.storage.client.insert(
+            table=self.table,
+            data=batch.data,
+            column_names=batch.column_names(),
+            column_oriented=True,
+            settings=settings,
+        )
+        return True
+
+    def close(self):
+        self.storage.close()
+
+
+# ---------------- PARQUET ----------------
+
+def _arrow_types() -> dict:
+    numeric = {"H": pa.uint16(), "Q": pa.uint64(), "B": pa.uint8()}
+    types = {name: numeric[code] for name, code in NUMERIC_TYPECODES.items()}
+    types.update({
+        "event_id": pa.string(),
+        "ts": pa.timestamp("us", tz="UTC"),
+        "src_ip": pa.string(),
+        "dest_ip": pa.string(),
+        "raw_zstd": pa.binary(),
+    })
+    return types
+
+
+def to_arrow(batch: ColumnBatch):
+    """
+    ColumnBatch -> pyarrow.Table. Typed numeric arrays are wrapped without
+    copying; UUIDs and IPs are written as their text form.
+    """
+    types = _arrow_types()
+    arrays = []
+    for name, column in zip(batch.columns, batch.data):
+        type_ = types.get(name, pa.string())
+        if name in NUMERIC_TYPECODES:
+            array = pa.Array.from_buffers(type_, len(column), [None, pa.py_buffer(column)])
+            if name == "alerted":
+                array = array.cast(pa.bool_())
+        elif name == "event_id":
+            array = pa.array([str(value) for value in column], type=type_)
+        elif name in ("src_ip", "dest_ip"):
+            # IPv4-mapped addresses go back to dotted IPv4
+            array = pa.array([str(value.ipv4_mapped or value) for value in column], type=type_)
+        else:
+            array = pa.array(column, type=type_)
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, names=list(batch.columns))
+
+
+class ParquetSink(StorageSink):
+    """
+    Local columnar archive: batches are gathered into row groups that are
+    written when they reach row_group_rows / row_group_bytes or get older
+    than row_group_s, and files roll at file_bytes / file_s.
+
+    A file is written as *.parquet.tmp and renamed when it is closed (the
+    footer makes it readable), so closing a file is the commit point.
+    """
+
+    name = "parquet"
+
+    def __init__(
+        self,
+        directory: str = PARQUET_DIR,
+        prefix: str | None = None,
+        row_group_rows: int = PARQUET_ROW_GROUP_ROWS,
+        row_group_bytes: int = PARQUET_ROW_GROUP_BYTES,
+        row_group_s: float = PARQUET_ROW_GROUP_S,
+        file_bytes: int = PARQUET_FILE_BYTES,
+        file_s: float = PARQUET_FILE_S,
+        compression: str = PARQUET_COMPRESSION,
+    ):
+        if pa is None:
+            raise RuntimeError("the parquet sink needs pyarrow (pip install pyarrow)")
+        self.directory = Path(directory)
+        self.prefix = prefix or socket.gethostname()
+        self.row_group_rows = row_group_rows
+        self.row_group_bytes = row_group_bytes
+        self.row_group_s = row_group_s
+        self.file_bytes = file_bytes
+        self.file_s = file_s
+        self.compression = compression
+        self.commit_delay_s = row_group_s + file_s
+
+        self.pending = []          # arrow tables of the row group being gathered
+        self.pending_rows = 0
+        self.pending_bytes = 0
+        self.pending_since = 0.0
+
+        self.writer = None
+        self.path = None
+        self.file_opened = 0.0
+        self.file_bytes_written = 0
+        self.seq = 0
+
+    def prepare(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # leftovers of a crash never got a footer and are unreadable
+        for tmp in self.directory.glob(f"{self.prefix}-*.parquet.tmp"):
+            print(f"Removing incomplete archive file {tmp.name}")
+            tmp.unlink()
+
+    def write(self, batch: ColumnBatch) -> bool:
+        if len(batch):
+            table = to_arrow(batch)
+            if not self.pending:
+                self.pending_since = time.monotonic()
+            self.pending.append(table)
+            self.pending_rows += table.num_rows
+            self.pending_bytes += table.nbytes
+
+        if (
+            self.pending_rows >= self.row_group_rows
+            or self.pending_bytes >= self.row_group_bytes
+            or (self.pending and time.monotonic() - self.pending_since >= self.row_group_s)
+        ):
+            self.write_row_group()
+
+        if self.writer is not None and (
+            self.file_bytes_written >= self.file_bytes
+            or time.monotonic() - self.file_opened >= self.file_s
+        ):
+            self.commit()
+            return True
+        return self.writer is None and not self.pending
+
+    def write_row_group(self):
+        if not self.pending:
+            return
+        table = pa.concat_tables(self.pending)
+        if self.writer is None:
+            self.open_file(table.schema)
+        self.writer.write_table(table, row_group_size=table.num_rows)
+        self.file_bytes_written += self.pending_bytes
+
+        self.pending = []
+        self.pending_rows = 0
+        self.pending_bytes = 0
+
+    def open_file(self, schema):
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        self.path = self.directory / f"{self.prefix}-{stamp}-{self.seq:06d}.parquet"
+        self.seq += 1
+        self.writer = pq.ParquetWriter(f"{self.path}.tmp", schema, compression=self.compression)
+        self.file_opened = time.monotonic()
+        self.file_bytes_written = 0
+
+    def commit(self):
+        self.write_row_group()
+        if self.writer is None:
+            return
+        self.writer.close()
+        tmp = Path(f"{self.path}.tmp")
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        tmp.rename(self.path)
+        print(f"Archived {self.path.name}")
+        self.writer = None
+        self.path = None
+
+
+def make_sink(name: str = SENTINEL_SINK, consumer_name: str | None = None) -> StorageSink:
+    """
+    Sink selected by SENTINEL_SINK: "clickhouse" (default) or "parquet".
+    Parquet files are prefixed with the consumer name so writers sharing a
+    directory never collide.
+    """
+    if name == ClickHouseSink.name:
+        return ClickHouseSink()
+    if name == ParquetSink.name:
+        return ParquetSink(prefix=consumer_name)
+    raise ValueError(f"unknown sink {name!r}, expected clickhouse or parquet")
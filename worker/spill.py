@@ -0,0 +1,235 @@
+import fcntl
+import mmap
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+
+
+# record = header + payload, header = (payload length, crc32 of payload)
+HEADER = struct.Struct("<II")
+SEGMENT_SUFFIX = ".wal"
+LOCK_FILE = ".lock"   # flocked by the process that owns a spill directory
+QUARANTINE_DIR = "quarantine"   # next to the spill directories: batches the sink rejects for good
+LOCK_WAIT_S = 30
+
+
+def lock_directory(directory: Path, wait_s: float = 0):
+    """
+    Exclusive flock on a spill directory, held while the returned file is
+    open (the kernel drops it when the process dies). None if another
+    process still holds it after wait_s, or the directory is gone.
+    """
+    deadline = time.monotonic() + wait_s
+    path = directory / LOCK_FILE
+    while True:
+        try:
+            lock = open(path, "a")
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # the previous holder may have removed the file before releasing it
+            if os.fstat(lock.fileno()).st_ino == os.stat(path).st_ino:
+                return lock
+        except (BlockingIOError, FileNotFoundError):
+            if time.monotonic() >= deadline:
+                lock.close()
+                return None
+            time.sleep(0.2)
+        lock.close()
+
+
+class SpillBuffer:
+    """
+    Local segmented write-ahead log for batches ClickHouse could not take.
+
+    Batches are appended (and fsynced) to the active segment file, and the
+    directory is fsynced whenever a segment is created or removed; segments
+    roll at segment_bytes and the whole log is capped at max_bytes. Sealed
+    segments are replayed through mmap and deleted once their batches are
+    stored. Not thread-safe: use it from one thread (the writer's insert
+    executor).
+
+    The directory is flocked for the life of the process. Spill directories
+    next to it that nobody holds belong to writers that are gone (a retired
+    supervisor slot, an older container); adopt_orphans() moves their
+    segments here so they are replayed instead of left on disk.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int, max_bytes: int):
+        self.directory = Path(directory)
+        deadline = time.monotonic() + LOCK_WAIT_S
+        while True:
+            if not self.directory.is_dir():
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self.sync_directory(self.directory.parent)
+            # another writer may be adopting (and removing) this directory
+            self.lock = lock_directory(self.directory, max(0.0, deadline - time.monotonic()))
+            if self.lock is not None:
+                break
+            if self.directory.is_dir():
+                raise RuntimeError(f"spill directory {self.directory} is in use by another process")
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+
+        self.sealed = sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}"))
+        self.size = sum(path.stat().st_size for path in self.sealed)
+        self.next_seq = int(self.sealed[-1].stem) + 1 if self.sealed else 0
+        self.active = None
+        self.active_path = None
+        self.active_size = 0
+
+    def pending(self) -> bool:
+        return bool(self.sealed) or self.active_size > 0
+
+    def segments(self) -> int:
+        return len(self.sealed) + (1 if self.active_size else 0)
+
+    def append(self, payload: bytes) -> bool:
+        """
+        Durably append one batch. False when it would exceed max_bytes.
+        """
+        record_size = HEADER.size + len(payload)
+        if self.size + record_size > self.max_bytes:
+            return False
+
+        if self.active is None:
+            self.active_path = self.directory / f"{self.next_seq:012d}{SEGMENT_SUFFIX}"
+            self.next_seq += 1
+            self.active = open(self.active_path, "ab")
+            self.active_size = 0
+            # the new entry must be durable too, or the fsynced segment can vanish
+            self.sync_directory()
+
+        self.active.write(HEADER.pack(len(payload), zlib.crc32(payload)))
+        self.active.write(payload)
+        self.active.flush()
+        os.fsync(self.active.fileno())
+
+        self.active_size += record_size
+        self.size += record_size
+        if self.active_size >= self.segment_bytes:
+            self.seal()
+        return True
+
+    def seal(self):
+        """
+        Close the active segment so it can be replayed
+        """
+        if self.active is None:
+            return
+        self.active.close()
+        if self.active_size:
+            self.sealed.append(self.active_path)
+        else:
+            self.active_path.unlink(missing_ok=True)
+            self.sync_directory()
+        self.active = None
+        self.active_path = None
+        self.active_size = 0
+
+    def adopt_orphans(self) -> int:
+        """
+        Move the segments of every unheld spill directory next to this one
+        into this spill, as sealed segments, and remove that directory.
+        Returns the number of segments adopted.
+        """
+        adopted = 0
+        for directory in sorted(self.directory.parent.iterdir()):
+            if directory == self.directory or directory.name == QUARANTINE_DIR or not directory.is_dir():
+                continue
+            lock = lock_directory(directory)
+            if lock is None:
+                continue
+            try:
+                for path in sorted(directory.glob(f"*{SEGMENT_SUFFIX}")):
+                    size = path.stat().st_size
+                    if not size:
+                        path.unlink()
+                        continue
+                    target = self.directory / f"{self.next_seq:012d}{SEGMENT_SUFFIX}"
+                    self.next_seq += 1
+                    path.rename(target)
+                    self.sealed.append(target)
+                    self.size += size
+                    adopted += 1
+                self.sync_directory()
+                (directory / LOCK_FILE).unlink()
+                directory.rmdir()
+                self.sync_directory(directory.parent)
+            except OSError as e:
+                print(f"Could not adopt spill directory {directory.name}:", e)
+            finally:
+                lock.close()
+        return adopted
+
+    def quarantine(self, payload: bytes) -> Path:
+        """
+        Durably set aside one batch the sink will never take, as a
+        single-record segment under quarantine/ for inspection and manual
+        replay. It no longer counts against max_bytes.
+        """
+        directory = self.directory.parent / QUARANTINE_DIR
+        if not directory.is_dir():
+            directory.mkdir(exist_ok=True)
+            self.sync_directory(directory.parent)
+        path = directory / f"{self.directory.name}-{time.time_ns()}{SEGMENT_SUFFIX}"
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(len(payload), zlib.crc32(payload)))
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self.sync_directory(directory)
+        return path
+
+    def close(self):
+        """
+        Seal the active segment and release the directory
+        """
+        self.seal()
+        self.lock.close()
+
+    def read_segment(self, path: Path) -> list:
+        """
+        Every intact record of a segment. Reading stops at the first torn or
+        corrupt record (e.g. a crash mid-append).
+        """
+        records = []
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return records
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                offset = 0
+                while offset + HEADER.size <= len(view):
+                    length, crc = HEADER.unpack_from(view, offset)
+                    start = offset + HEADER.size
+                    payload = view[start:start + length]
+                    if len(payload) != length or zlib.crc32(payload) != crc:
+                        print(f"Spill segment {path.name}: corrupt record at offset {offset}, ignoring the rest")
+                        break
+                    records.append(payload)
+                    offset = start + length
+        return records
+
+    def drop(self, path: Path):
+        """
+        Delete a replayed segment
+        """
+        size = path.stat().st_size
+        path.unlink()
+        self.sync_directory()
+        self.sealed.remove(path)
+        self.size -= size
+
+    def sync_directory(self, directory: Path | None = None):
+        """
+        fsync a directory (the spill's own by default) so creating and
+        removing entries in it survives a crash
+        """
+        fd = os.open(directory or self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -1,23 +1,59 @@
-import clickhouse_connect
-# from sentinel.app.config import settings
+import os
+import threading
 
 
-CH_PASSWORD="6vTR6GF~QtbAS"
-CH_USER="default"
-CH_HOST="vxcfphwoh3.ap-south-1.aws.clickhouse.cloud"
+# ---------------- CONFIG ----------------
 
+CH_HOST = os.getenv("CH_HOST", "localhost")
+CH_PORT = int(os.getenv("CH_PORT", 0))   # 0 = default port for the protocol
+CH_USER = os.getenv("CH_USER", "default")
+CH_PASSWORD = os.getenv("CH_PASSWORD", "")
+CH_SECURE = os.getenv("CH_SECURE", "false").lower() in ("1", "true", "yes")   # TLS, e.g. for ClickHouse Cloud
 
-class ClickHouseStorage:
-    def __init__(self):
-        self.client = clickhouse_connect.get_client(
-            host=CH_HOST,
-            user=CH_USER,
-            password=CH_PASSWORD,
-            secure=True
-        )
 
+class ClickHouseStorage:
+    """
+    ClickHouse connection opened on first use of .client, so importing a
+    module that needs ClickHouse never touches the network.
+    """
+
+    def __init__(
+        self,
+        host: str = CH_HOST,
+        port: int = CH_PORT,
+        user: str = CH_USER,
+        password: str = CH_PASSWORD,
+        secure: bool = CH_SECURE,
+    ):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.secure = secure
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import clickhouse_connect
+
+                    self._client = clickhouse_connect.get_client(
+                        host=self.host,
+                        port=self.port,
+                        user=self.user,
+                        password=self.password,
+                        secure=self.secure,
+                    )
+        return self._client
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
 
 
 connection = ClickHouseStorage()
-
-# print(connection.client)
\ No newline at end of file
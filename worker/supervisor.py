@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import importlib
+import math
+import multiprocessing
+import signal
+import socket
+import time
+from dataclasses import dataclass, field
+
+from termtrix_common.termtrix_common.redis_client import redis_client
+from termtrix_common.termtrix_common.topology import (
+    DETECTION_GROUP,
+    NORMALIZED_STREAM,
+    NORMALIZER_GROUP,
+    RAW_STREAM,
+    STORAGE_GROUP,
+)
+
+
+# ---------------- CONFIG ----------------
+
+CHECK_INTERVAL_S = 10
+SCALE_DOWN_COOLDOWN_S = 60   # a stage must stay under target this long before losing a worker
+STOP_TIMEOUT_S = 30
+
+
+@dataclass
+class StageSpec:
+    name: str
+    entry: str                  # "module:coroutine_function(consumer_name)"
+    stream: str
+    group: str
+    min_workers: int = 1
+    max_workers: int = 4
+    backlog_per_worker: int = 5000   # lag + pending one worker is expected to absorb
+
+
+STAGES = {
+    "normalizer": StageSpec(
+        name="normalizer",
+        entry="worker.consumer:consume",
+        stream=RAW_STREAM,
+        group=NORMALIZER_GROUP,
+    ),
+    "writer": StageSpec(
+        name="writer",
+        entry="worker.clickhouse_writer:main",
+        stream=NORMALIZED_STREAM,
+        group=STORAGE_GROUP,
+    ),
+    "detector": StageSpec(
+        name="detector",
+        entry="sentinel.detection_engine.detection_consumer:main",
+        stream=NORMALIZED_STREAM,
+        group=DETECTION_GROUP,
+    ),
+}
+
+
+def run_stage(entry: str, consumer_name: str):
+    """
+    Child process target: import the stage module fresh and run its loop
+    under a unique consumer name.
+    """
+    module_name, func_name = entry.split(":")
+    module = importlib.import_module(module_name)
+    asyncio.run(getattr(module, func_name)(consumer_name))
+
+
+@dataclass
+class StagePool:
+    spec: StageSpec
+    workers: dict = field(default_factory=dict)   # slot -> Process
+    below_target_since: float | None = None
+
+    def consumer_name(self, slot: int) -> str:
+        # slots are reused so a restarted worker keeps its consumer name
+        return f"{self.spec.name}-{socket.gethostname()}-{slot}"
+
+    def start_worker(self, ctx):
+        slot = next(i for i in range(len(self.workers) + 1) if i not in self.workers)
+        name = self.consumer_name(slot)
+        process = ctx.Process(target=run_stage, args=(self.spec.entry, name), name=name, daemon=False)
+        process.start()
+        self.workers[slot] = process
+        print(f"[{self.spec.name}] started {name} (pid {process.pid})")
+
+    def stop_worker(self, slot: int):
+        process = self.workers.pop(slot)
+        process.terminate()   # SIGTERM: consumers finish their current batch
+        process.join(STOP_TIMEOUT_S)
+        if process.is_alive():
+            process.kill()
+        print(f"[{self.spec.name}] stopped {process.name}")
+
+    def reap(self) -> int:
+        """
+        Forget workers that exited on their own, return how many died.
+        """
+        dead = [slot for slot, process in self.workers.items() if not process.is_alive()]
+        for slot in dead:
+            process = self.workers.pop(slot)
+            print(f"[{self.spec.name}] {process.name} exited with code {process.exitcode}")
+        return len(dead)
+
+
+class Supervisor:
+    def __init__(self, stages: list[StageSpec]):
+        self.ctx = multiprocessing.get_context("spawn")
+        self.pools = [StagePool(spec) for spec in stages]
+        self.running = True
+
+    async def group_backlog(self, spec: StageSpec) -> tuple[int, dict]:
+        """
+        (lag + pending) for the stage's group, plus pending count per consumer.
+        """
+        lag = 0
+        pending = 0
+        try:
+            for group in await redis_client.xinfo_groups(spec.stream):
+                if group["name"] == spec.group:
+                    lag = group.get("lag") or 0   # None when Redis can't compute it
+                    pending = group.get("pending") or 0
+        except Exception as e:
+            print(f"[{spec.name}] XINFO GROUPS failed:", e)
+            return 0, {}
+
+        per_consumer = {}
+        if pending:
+            summary = await redis_client.xpending(spec.stream, spec.group)
+            per_consumer = {c["name"]: int(c["pending"]) for c in summary.get("consumers") or []}
+
+        return lag + pending, per_consumer
+
+    def desired_workers(self, spec: StageSpec, backlog: int) -> int:
+        wanted = math.ceil(backlog / spec.backlog_per_worker) if backlog else 0
+        return max(spec.min_workers, min(spec.max_workers, wanted))
+
+    async def rebalance(self, pool: StagePool):
+        spec = pool.spec
+        pool.reap()
+        backlog, per_consumer = await self.group_backlog(spec)
+        desired = self.desired_workers(spec, backlog)
+        current = len(pool.workers)
+
+        if desired > current:
+            pool.below_target_since = None
+            for _ in range(desired - current):
+                pool.start_worker(self.ctx)
+            print(f"[{spec.name}] backlog {backlog}: scaled {current} -> {desired}")
+            return
+
+        if desired < current:
+            now = time.monotonic()
+            if pool.below_target_since is None:
+                pool.below_target_since = now
+            elif now - pool.below_target_since >= SCALE_DOWN_COOLDOWN_S:
+                # retire the worker holding the fewest pending entries
+                slot = min(pool.workers, key=lambda s: per_consumer.get(pool.consumer_name(s), 0))
+                await asyncio.to_thread(pool.stop_worker, slot)
+                pool.below_target_since = now
+                print(f"[{spec.name}] backlog {backlog}: scaled {current} -> {current - 1}")
+            return
+
+        pool.below_target_since = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, self.stop)
+        loop.add_signal_handler(signal.SIGINT, self.stop)
+
+        for pool in self.pools:
+            for _ in range(pool.spec.min_workers):
+                pool.start_worker(self.ctx)
+
+        while self.running:
+            for pool in self.pools:
+                try:
+                    await self.rebalance(pool)
+                except Exception as e:
+                    print(f"[{pool.spec.name}] rebalance failed:", e)
+            await asyncio.sleep(CHECK_INTERVAL_S)
+
+        for pool in self.pools:
+            for slot in list(pool.workers):
+                await asyncio.to_thread(pool.stop_worker, slot)
+
+    def stop(self):
+        self.running = False
+
+
+def parse_stage(value: str) -> StageSpec:
+    """
+    "writer" or "writer=2:8" (min:max workers)
+    """
+    name, _, bounds = value.partition("=")
+    if name not in STAGES:
+        raise argparse.ArgumentTypeError(f"unknown stage {name!r}, expected one of {', '.join(STAGES)}")
+    spec = STAGES[name]
+    if bounds:
+        low, _, high = bounds.partition(":")
+        spec = StageSpec(**{**spec.__dict__, "min_workers": int(low), "max_workers": int(high or low)})
+    if spec.min_workers < 1 or spec.max_workers < spec.min_workers:
+        raise argparse.ArgumentTypeError(f"invalid worker bounds for {name}: {bounds}")
+    return spec
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run and autoscale Sentinel stream consumers")
+    parser.add_argument(
+        "--stage",
+        action="append",
+        type=parse_stage,
+        help="stage to supervise, optionally with bounds: normalizer=1:8 (repeatable)",
+    )
+    args = parser.parse_args()
+    stages = args.stage or [STAGES["normalizer"], STAGES["writer"]]
+
+    print("SUPERVISOR STARTED", ", ".join(f"{s.name}[{s.min_workers}..{s.max_workers}]" for s in stages))
+    asyncio.run(Supervisor(stages).run())
@@ -0,0 +1,55 @@
+from collections import Counter
+from datetime import datetime
+
+from dateutil.parser import parse as dateutil_parse
+
+
+def parse_iso_fast(value: str) -> datetime | None:
+    """
+    Fast path for the timestamp shapes we actually receive:
+
+      2025-12-31T07:11:36.578784Z          structlog / Vector
+      2025-12-31T12:34:54+05:30            nginx $time_iso8601
+      2025-12-31T12:34:54.466448+0530      Suricata eve.json
+
+    Returns None for anything else so the caller can fall back to dateutil.
+    """
+    if len(value) < 19 or value[10] not in "T ":
+        return None
+
+    if value[-1] == "Z":
+        value = value[:-1] + "+00:00"
+    elif len(value) >= 24 and value[-5] in "+-" and value[-4:].isdigit():
+        # basic-format offset (+0530) -> extended (+05:30) for fromisoformat on 3.10
+        value = value[:-2] + ":" + value[-2:]
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+class TimestampParser:
+    """
+    datetime parsing with per-source fast-path hit/miss counters.
+    """
+
+    def __init__(self):
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def parse(self, value, source: str = "unknown") -> datetime:
+        if isinstance(value, str):
+            ts = parse_iso_fast(value)
+            if ts is not None:
+                self.hits[source] += 1
+                return ts
+
+        self.misses[source] += 1
+        return dateutil_parse(value)
+
+    def stats(self) -> dict:
+        return {
+            source: {"fast": self.hits[source], "fallback": self.misses[source]}
+            for source in sorted(set(self.hits) | set(self.misses))
+        }